@@ -0,0 +1,187 @@
+'''Compares the speed and the output of the rendering backends on every theme
+
+python benchmark.py [--frames N]
+
+With --scaling, checks that the line graphic costs the same per station
+however long the line is. With --memory, checks that the peak memory of
+stream_video() does not grow with the length of the line
+'''
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import metroani
+from metroani import graphics
+from metroani.ft import plan_frames
+from metroani.surface import BACKENDS
+from metroani.timeline import make_timeline
+from metroani.utils import find_prev_unskipped_station, station_window
+
+THEMES = {
+    'metro': 'settings/full.json',
+    'yamanote': 'settings/joban.json',
+    'jr': 'settings/keihin.json',
+    'tokyu': 'settings/den_en_toshi.json',
+}
+
+
+def render(settings, frames):
+    '''Renders the first frames of the video, spread over its transitions'''
+    constants, station_settings, terminal_settings, _, service_settings = (
+        settings
+    )
+    times = np.linspace(0, constants.duration, 6)
+    images = []
+    for segment in make_timeline(*settings):
+        draw = plan_frames(
+            constants=constants, n=segment.n, settings=station_settings,
+            next_settings=segment.next_settings,
+            terminal_settings=terminal_settings,
+            old=segment.old, new=segment.new,
+            old_next=segment.old_next, new_next=segment.new_next,
+            old_term=segment.old_term, new_term=segment.new_term,
+            service_settings=service_settings,
+            old_service=segment.old_service, new_service=segment.new_service,
+            arrow_moves=segment.arrow_moves
+        )
+        for t in times:
+            if len(images) == frames:
+                return images
+            images.append(draw(t))
+    return images
+
+
+def long_line(settings, stations):
+    '''The stations of the settings repeated into a line of that many
+    stations, with every third station skipped
+    '''
+    station_settings = settings[1]
+    return [
+        station_settings[idx % len(station_settings)]._replace(
+            skip=idx % 3 == 2
+        )
+        for idx in range(stations)
+    ]
+
+
+def time_windows(station_settings, loop):
+    '''Seconds to look up the window and the previous station of every
+    station of the line
+    '''
+    start = time.perf_counter()
+    for idx in range(len(station_settings)):
+        station_window(station_settings, idx, loop=loop)
+        if idx or loop:
+            find_prev_unskipped_station(idx, station_settings, loop)
+    return time.perf_counter() - start
+
+
+def check_scaling(short=2_000, factor=10, tolerance=3):
+    '''Asserts that looking up every station of a line factor times longer
+    takes about factor times longer, not factor squared
+    '''
+    settings = metroani.settings_from_json(THEMES['metro'])
+    for loop in (False, True):
+        # Best of a few runs, to ignore noise
+        times = [
+            min(time_windows(long_line(settings, n), loop) for _ in range(3))
+            for n in (short, short * factor)
+        ]
+        ratio = times[1] / times[0]
+        print(
+            f'loop={loop}: {short} stations {times[0] * 1000:.1f}ms, '
+            f'{short * factor} stations {times[1] * 1000:.1f}ms, '
+            f'{ratio:.1f}x'
+        )
+        assert ratio < factor * tolerance, (
+            f'{factor}x more stations took {ratio:.1f}x longer'
+        )
+
+
+def stream_rss(stations):
+    '''Streams a line of that many stations with short transitions, and
+    returns the peak RSS of this process in MB
+    '''
+    settings = metroani.settings_from_json(THEMES['metro'])
+    constants = settings[0]._replace(duration=0.2, freeze_duration=0.1)
+    with tempfile.TemporaryDirectory() as directory:
+        metroani.stream_video(
+            [metroani.Sink(os.path.join(directory, 'line.mp4'))],
+            constants, long_line(settings, stations), *settings[2:],
+            fps=5, logger=None
+        )
+    # Kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def check_memory(short=10, factor=5, tolerance=1.2):
+    '''Asserts that streaming a line factor times longer does not use more
+    memory at its peak, each in a new process
+    '''
+    peaks = [
+        float(subprocess.run(
+            [sys.executable, __file__, '--stream-rss', str(n)],
+            check=True, capture_output=True, text=True
+        ).stdout.split()[-1])
+        for n in (short, short * factor)
+    ]
+    print(
+        f'Peak RSS: {short} stations {peaks[0]:.0f}MB, '
+        f'{short * factor} stations {peaks[1]:.0f}MB'
+    )
+    assert peaks[1] < peaks[0] * tolerance, (
+        f'Peak RSS grew from {peaks[0]:.0f}MB to {peaks[1]:.0f}MB'
+    )
+
+
+def compare_backends(frames):
+    for theme, path in THEMES.items():
+        settings = metroani.settings_from_json(path)
+        results = {}
+        for name in BACKENDS:
+            metroani.set_backend(name)
+            # Sprites are cached per backend, so both start cold
+            for sprite in graphics.SPRITES.values():
+                sprite.cache_clear()
+            start = time.perf_counter()
+            images = render(settings, frames)
+            fps = len(images) / (time.perf_counter() - start)
+            results[name] = (fps, images)
+
+        reference, *others = results
+        for name in others:
+            differing = sum(
+                not np.array_equal(a, b)
+                for a, b in zip(results[reference][1], results[name][1])
+            )
+            print(
+                f'{theme:>8}: {reference} {results[reference][0]:.1f} fps, '
+                f'{name} {results[name][0]:.1f} fps, '
+                f'{differing}/{len(results[name][1])} frames differ'
+            )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=60)
+    parser.add_argument('--scaling', action='store_true')
+    parser.add_argument('--memory', action='store_true')
+    # Used by check_memory() in a new process
+    parser.add_argument('--stream-rss', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stream_rss:
+        print(stream_rss(args.stream_rss))
+    elif args.scaling or args.memory:
+        if args.scaling:
+            check_scaling()
+        if args.memory:
+            check_memory()
+    else:
+        compare_backends(args.frames)
@@ -1,2 +1,18 @@
 from .metroani import *
 from .s_types import *
+from .render import *
+from .batch import *
+from .sinks import *
+from .library import *
+from .splice import *
+from .resolution import *
+from .framestore import *
+from .service import *
+from .metrics import *
+from .sequence import *
+from .surface import *
+from .fit import *
+from .atlas import *
+from .compiled import *
+from .audio import *
+from .overlay import *
@@ -1,16 +1,20 @@
 '''Animation functions'''
 import moviepy.editor as mpy
-import moviepy.video.fx.all as vfx
 
-from .ft import make_frames
+from .batch import render_transition
+from .ft import plan_frames
 from .utils import pairs
 
 
 def animate(n, settings, next_settings, terminal_settings, constants, service_settings):
-    '''Animates a transition between two languages'''
+    '''Animates a transition between two languages. Skipped stations are
+    passed without transitions, like in make_timeline()
+    '''
+    if settings[n].skip:
+        return ()
     return (
         mpy.VideoClip(
-            make_frames(
+            plan_frames(
                 constants=constants, n=n, settings=settings,
                 next_settings=next_settings, terminal_settings=terminal_settings,
                 old=names[0], new=names[1], old_next=next_[0], new_next=next_[1],
@@ -25,20 +29,28 @@ def animate(n, settings, next_settings, terminal_settings, constants, service_se
             pairs(settings[n].names), pairs(next_settings.names),
             pairs(terminal_settings.names), pairs(service_settings.names)
         )
-        if any([not settings[n].skip for name in names])
     )
 
 
-def freeze_end(clip, constants):
-    return clip.fx(
-        vfx.freeze, t=constants.duration,
-        freeze_duration=constants.freeze_duration
+def freeze_at(clip, t, freeze_duration):
+    '''Same as vfx.freeze, which drops the alpha of RGBA frames such as
+    those of overlays, but keeps every channel of the frozen frame
+    '''
+    frozen = mpy.ImageClip(
+        clip.get_frame(t), transparent=False, duration=freeze_duration
     )
+    before = [clip.subclip(0, t)] if t != 0 else []
+    after = [clip.subclip(t)] if t != clip.duration else []
+    return mpy.concatenate_videoclips(before + [frozen] + after)
+
+
+def freeze_end(clip, constants):
+    return freeze_at(clip, constants.duration, constants.freeze_duration)
 
 
 def freeze_both(clip, constants):
-    return freeze_end(clip, constants).fx(
-        vfx.freeze, t=0, freeze_duration=constants.freeze_duration
+    return freeze_at(
+        freeze_end(clip, constants), 0, constants.freeze_duration
     )
 
 
@@ -67,6 +79,52 @@ def combine_language_transitions(
     ])
 
 
+def animate_segment(
+    segment, station_settings, terminal_settings, constants, service_settings,
+    scale=1, overlay=False
+):
+    '''Animates a single segment of the timeline, including its freezes.
+    Frames are scale times the size of the constants, and RGBA overlays
+    without the background if overlay is True
+    '''
+    clip = mpy.VideoClip(
+        plan_frames(
+            constants=constants, n=segment.n, settings=station_settings,
+            next_settings=segment.next_settings,
+            terminal_settings=terminal_settings,
+            old=segment.old, new=segment.new,
+            old_next=segment.old_next, new_next=segment.new_next,
+            old_term=segment.old_term, new_term=segment.new_term,
+            service_settings=service_settings,
+            old_service=segment.old_service, new_service=segment.new_service,
+            scale=scale, overlay=overlay,
+            arrow_moves=segment.arrow_moves
+        ),
+        duration=constants.duration
+    )
+    return freeze(segment.pair, clip, constants)
+
+
+def animate_segment_batch(
+    segment, station_settings, terminal_settings, constants, service_settings,
+    fps
+):
+    '''Same as animate_segment, but renders the whole transition at once'''
+    frames = render_transition(
+        constants=constants, n=segment.n, settings=station_settings,
+        next_settings=segment.next_settings,
+        terminal_settings=terminal_settings,
+        old=segment.old, new=segment.new,
+        old_next=segment.old_next, new_next=segment.new_next,
+        old_term=segment.old_term, new_term=segment.new_term,
+        service_settings=service_settings,
+        old_service=segment.old_service, new_service=segment.new_service,
+        fps=fps, arrow_moves=segment.arrow_moves
+    )
+    clip = mpy.ImageSequenceClip(list(frames), fps=fps)
+    return freeze(segment.pair, clip.set_duration(constants.duration), constants)
+
+
 def combine_train_states(
     n, station_settings, state_settings, terminal_settings, constants, service_settings
 ):
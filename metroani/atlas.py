@@ -0,0 +1,215 @@
+'''Sprite atlas: the station numbers, names and transfer labels of a line,
+rasterized before rendering
+
+All of the sprites of the line info are known from the settings, so
+build_atlas() rasterizes them in a pool of worker processes and packs them
+into one image, with an index of where every sprite is:
+
+    python -m metroani.atlas settings/full.json
+
+writes settings/full.atlas.npy and settings/full.atlas.json. Workers that
+load it with use_atlas() memory-map the image instead of rasterizing text.
+Sprites are keyed by what they draw, so an atlas of older settings never
+draws wrong sprites: the ones that it does not have are rasterized as usual
+'''
+import argparse
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from . import graphics
+from .graphics import (
+    SpriteImage, FADE_STEPS, MAX_STATIONS, fraction, line_layout, sprite_key,
+    station_labels, transfer_label
+)
+from .metroani import settings_from_json
+from .surface import BACKENDS
+from .utils import station_window
+
+__all__ = [
+    'Atlas', 'build_atlas', 'save_atlas', 'load_atlas', 'use_atlas',
+    'atlas_path'
+]
+
+ATLAS_WIDTH = 2048  # Pixels, wider sprites get a row of their own
+
+
+class Atlas:
+    '''Sprite images packed into one RGBA image. The index maps the key of
+    every sprite to its [x, y, width, height, left, top] in the image, or
+    None if the sprite is empty
+    '''
+    def __init__(self, image, index):
+        self.pixels = image
+        self.index = index
+
+    def __contains__(self, key):
+        return key in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def image(self, key):
+        '''The SpriteImage of the key, copied out of the atlas'''
+        if (entry := self.index[key]) is None:
+            return None
+        x, y, width, height, left, top = entry
+        image = np.ascontiguousarray(self.pixels[y:y + height, x:x + width])
+        return SpriteImage(image, left, top)
+
+
+def atlas_requests(constants, station_settings, scale=1, backend='gizeh'):
+    '''Every sprite of the line info, as {key: (image function, arguments)}'''
+    layout = line_layout(constants)
+    requests = {}
+    for station_idx in range(len(station_settings)):
+        settings_to_show, _ = station_window(
+            station_settings, station_idx, MAX_STATIONS, constants.loop
+        )
+        for n, setting in zip(range(MAX_STATIONS), settings_to_show):
+            labels = station_labels(setting, n, layout, constants)
+            if constants.animate_transfers and setting.transfers:
+                # Every language, at every alpha that it fades through
+                languages = max(map(len, setting.transfers))
+                labels += [
+                    transfer_label(
+                        setting, n, layout, constants, language,
+                        step / FADE_STEPS
+                    )
+                    for language in range(languages)
+                    for step in range(1, FADE_STEPS + 1)
+                ]
+            for make_image, kwargs, xy in labels:
+                kwargs = dict(kwargs, frac_xy=fraction(xy, scale), scale=scale)
+                key = sprite_key(make_image, kwargs, BACKENDS[backend])
+                requests[key] = (make_image, kwargs)
+    return requests
+
+
+def rasterize(requests, backend):
+    '''Images of a chunk of requests, in a worker'''
+    return [
+        make_image(**kwargs, backend=BACKENDS[backend])
+        for make_image, kwargs in requests
+    ]
+
+
+def pack(images, width=ATLAS_WIDTH):
+    '''Places the images in rows, tallest first. Returns the packed image and
+    the (x, y) of every image
+    '''
+    order = sorted(
+        range(len(images)), key=lambda i: images[i].shape[0], reverse=True
+    )
+    positions = [None] * len(images)
+    x = y = row_height = 0
+    width = max([width] + [image.shape[1] for image in images])
+    for i in order:
+        height, image_width = images[i].shape[:2]
+        if x + image_width > width:
+            x, y, row_height = 0, y + row_height, 0
+        positions[i] = (x, y)
+        x += image_width
+        row_height = max(row_height, height)
+
+    packed = np.zeros((y + row_height, width, 4), np.uint8)
+    for image, (x, y) in zip(images, positions):
+        packed[y:y + image.shape[0], x:x + image.shape[1]] = image
+    return packed, positions
+
+
+def build_atlas(
+    constants, station_settings, scales=(1,), backend='gizeh', workers=None
+):
+    '''Rasterizes every sprite of the line info at every scale in parallel'''
+    requests = {}
+    for scale in scales:
+        requests.update(
+            atlas_requests(constants, station_settings, scale, backend)
+        )
+    keys = list(requests)
+
+    workers = workers or os.cpu_count() or 1
+    size = math.ceil(len(keys) / (4 * workers)) or 1
+    chunks = [
+        [requests[key] for key in keys[i:i + size]]
+        for i in range(0, len(keys), size)
+    ]
+    with ProcessPoolExecutor(workers) as pool:
+        results = [
+            sprite
+            for chunk in pool.map(rasterize, chunks, [backend] * len(chunks))
+            for sprite in chunk
+        ]
+
+    sprites = [sprite for sprite in results if sprite is not None]
+    packed, positions = pack([sprite.image for sprite in sprites])
+    entries = iter(zip(sprites, positions))
+    index = {}
+    for key, sprite in zip(keys, results):
+        if sprite is None:
+            index[key] = None
+            continue
+        (image, left, top), (x, y) = next(entries)
+        index[key] = [
+            x, y, image.shape[1], image.shape[0], int(left), int(top)
+        ]
+    return Atlas(packed, index)
+
+
+def atlas_path(settings_path):
+    '''Where the atlas of a settings file is stored, without extension'''
+    return os.path.splitext(settings_path)[0] + '.atlas'
+
+
+def save_atlas(atlas, path):
+    '''Writes the atlas to path.npy and its index to path.json'''
+    np.save(path + '.npy', atlas.pixels)
+    with open(path + '.json', 'w') as f:
+        json.dump(atlas.index, f)
+
+
+def load_atlas(path):
+    '''Loads an atlas written by save_atlas(), memory-mapping its image'''
+    with open(path + '.json', 'r') as f:
+        index = json.load(f)
+    return Atlas(np.load(path + '.npy', mmap_mode='r'), index)
+
+
+def use_atlas(atlas):
+    '''Draws the sprites that the atlas has from it from now on, or
+    rasterizes all of them again if atlas is None
+    '''
+    graphics.atlas = atlas
+    for sprite in graphics.SPRITES.values():
+        sprite.cache_clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Rasterizes the sprites of a settings file into an atlas'
+    )
+    parser.add_argument('settings')
+    parser.add_argument(
+        '--scales', type=float, nargs='+', default=[1],
+        help='Scales of the frames that will be rendered'
+    )
+    parser.add_argument('--backend', default='gizeh')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    constants, station_settings, *_ = settings_from_json(args.settings)
+    atlas = build_atlas(
+        constants, station_settings, args.scales, args.backend, args.workers
+    )
+    path = atlas_path(args.settings)
+    save_atlas(atlas, path)
+    height, width, _ = atlas.pixels.shape
+    print(f'{len(atlas)} sprites in {width}x{height} pixels: {path}.npy')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,183 @@
+'''Announcement audio, placed on the timeline and mixed into rendered videos
+
+Audio files are given per station, train state and language as
+{(station index, state index, language index): filename}. A file starts with
+the segment that shows that language first, the language of its old
+translation. Files keyed by (station index, state index) only, such as
+chimes, start with the first segment of the station and state.
+
+Files are decoded and mixed a chunk at a time while they are written, so
+only the part of every file that is being mixed is in memory
+'''
+from __future__ import annotations
+import subprocess
+import sys
+from collections import deque
+from typing import NamedTuple
+
+import numpy as np
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from .timeline import iter_timeline
+
+__all__ = ['place_announcements', 'write_audio', 'mux_audio']
+
+SAMPLE_RATE = 44100
+CHANNELS = 2
+
+
+class Placement(NamedTuple):
+    '''An audio file placed on the timeline'''
+    filename: str
+    start: float  # Seconds since the start of the video
+    room: float  # Seconds until the segments it was placed at end
+
+
+def place_announcements(announcements, timeline):
+    '''Placements of the audio files at their segments of the timeline,
+    sorted by their start. Warns about files that are longer than their
+    segments, and keys that are not in the timeline, such as skipped stations
+    '''
+    starts = {}
+    rooms = {}
+    for segment in timeline:
+        language = (segment.n, segment.state, segment.pair)
+        starts[language] = segment.start
+        rooms[language] = segment.duration
+        # The station and state, over all of its languages
+        group = (segment.n, segment.state)
+        starts.setdefault(group, segment.start)
+        rooms[group] = rooms.get(group, 0) + segment.duration
+
+    placements = []
+    for key, filename in announcements.items():
+        if (key := tuple(key)) not in starts:
+            print(f'{filename}: {key} is not in the timeline', file=sys.stderr)
+            continue
+        placement = Placement(filename, starts[key], rooms[key])
+        duration = ffmpeg_parse_infos(filename)['duration']
+        if duration > placement.room:
+            print(
+                f'{filename} is {duration:.2f}s long, but its segments are '
+                f'{placement.room:.2f}s long',
+                file=sys.stderr
+            )
+        placements.append(placement)
+    return sorted(placements, key=lambda placement: placement.start)
+
+
+class ClipReader:
+    '''Decodes an audio file into samples with ffmpeg, as they are read'''
+    def __init__(self, filename, rate, channels):
+        self.channels = channels
+        self.process = subprocess.Popen(
+            [
+                get_setting('FFMPEG_BINARY'), '-loglevel', 'error',
+                '-i', filename, '-f', 's16le', '-acodec', 'pcm_s16le',
+                '-ar', str(rate), '-ac', str(channels), '-'
+            ],
+            stdout=subprocess.PIPE
+        )
+
+    def read(self, samples):
+        '''Up to samples samples, fewer at the end of the file'''
+        data = self.process.stdout.read(samples * self.channels * 2)
+        return np.frombuffer(data, np.int16).reshape(-1, self.channels)
+
+    def close(self):
+        self.process.stdout.close()
+        self.process.wait()
+
+
+def mixed_chunks(placements, duration, rate, channels, chunk_seconds=1):
+    '''Yields the mix of the placed files as arrays of (samples, channels)
+    16-bit samples, chunk_seconds at a time
+    '''
+    pending = deque(placements)
+    active = []  # [reader, next sample of the timeline it is read into]
+    total = round(duration * rate)
+    chunk = round(chunk_seconds * rate)
+    try:
+        for begin in range(0, total, chunk):
+            end = min(begin + chunk, total)
+            while pending and round(pending[0].start * rate) < end:
+                placement = pending.popleft()
+                active.append([
+                    ClipReader(placement.filename, rate, channels),
+                    round(placement.start * rate)
+                ])
+
+            mix = np.zeros((end - begin, channels), np.int32)
+            for entry in list(active):
+                reader, position = entry
+                offset = position - begin
+                samples = reader.read(end - position)
+                mix[offset:offset + len(samples)] += samples
+                entry[1] = position + len(samples)
+                if entry[1] < end:
+                    reader.close()
+                    active.remove(entry)
+            yield np.clip(mix, -2**15, 2**15 - 1).astype(np.int16)
+    finally:
+        for reader, _ in active:
+            reader.close()
+
+
+def encode_mix(inputs, outputs, placements, duration, rate, channels):
+    '''Streams the mix into ffmpeg as the input after the other inputs'''
+    process = subprocess.Popen(
+        [
+            get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error', *inputs,
+            '-f', 's16le', '-ar', str(rate), '-ac', str(channels), '-i', '-',
+            *outputs
+        ],
+        stdin=subprocess.PIPE
+    )
+    try:
+        for samples in mixed_chunks(placements, duration, rate, channels):
+            process.stdin.write(samples.tobytes())
+    finally:
+        process.stdin.close()
+        process.wait()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def timeline_placements(announcements, settings):
+    timeline = list(iter_timeline(*settings))
+    duration = sum(segment.duration for segment in timeline)
+    return place_announcements(announcements, timeline), duration
+
+
+def write_audio(
+    filename, announcements, constants, station_settings, terminal_settings,
+    state_settings, service_settings, rate=SAMPLE_RATE, channels=CHANNELS
+):
+    '''Writes the audio track of the video of the settings, with every
+    announcement at its segment, to an audio file
+    '''
+    placements, duration = timeline_placements(announcements, (
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    ))
+    encode_mix([], [filename], placements, duration, rate, channels)
+
+
+def mux_audio(
+    video, output, announcements, constants, station_settings,
+    terminal_settings, state_settings, service_settings, codec='aac',
+    rate=SAMPLE_RATE, channels=CHANNELS
+):
+    '''Copies a rendered video of the settings to output, with the audio
+    track of the announcements encoded with codec
+    '''
+    placements, duration = timeline_placements(announcements, (
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    ))
+    encode_mix(
+        ['-i', video],
+        ['-map', '0:v', '-map', '1:a', '-c:v', 'copy', '-c:a', codec, output],
+        placements, duration, rate, channels
+    )
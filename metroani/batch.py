@@ -0,0 +1,226 @@
+'''Renders a whole transition at once, as an array of frames
+
+Every frame of a transition is the same background and foreground, with the
+same few texts in between that only differ by a vertical scale and an alpha.
+Instead of drawing every frame with cairo, the texts are rasterized once and
+scaled and blended for all frames at once with numpy.
+'''
+import math
+
+import numpy as np
+
+from .ft import (
+    draw_background, draw_foreground, make_text_layers, station_language,
+    transfer_alphas
+)
+from .graphics import (
+    arrow_box, arrow_layer, draw_arrow_layer, draw_transfer_layer,
+    transfer_box, transfer_layer
+)
+from .surface import get_backend, make_surface
+
+__all__ = ['render_transition']
+
+
+def frame_times(duration, fps):
+    # Same times as VideoClip.iter_frames()
+    return np.arange(0, duration, 1.0 / fps)
+
+
+def text_sprite(layer, width, height):
+    '''Coverage (0-1) of the text at full vertical scale, cropped to its
+    bounding box. Returns None if nothing is visible
+    '''
+    surface = make_surface(width, height)
+    surface.text(
+        layer.text, layer.font, layer.fontsize, xy=layer.xy, fill=(1, 1, 1),
+        scale_x=layer.x_scale, center=layer.center_xy
+    )
+    coverage = surface.get_npimage(transparent=True)[:, :, 3]
+
+    rows = np.flatnonzero(coverage.any(axis=1))
+    cols = np.flatnonzero(coverage.any(axis=0))
+    if rows.size == 0:
+        return None
+    top, left = rows[0], cols[0]
+    sprite = coverage[top:rows[-1] + 1, left:cols[-1] + 1].astype(np.float32) / 255
+    return sprite, top, left
+
+
+def scaled_rows(sprite, top, center_y, scales, height):
+    '''The rows that the sprite covers at any of the scales'''
+    bottom = top + len(sprite)
+    ends = center_y + np.outer(scales, [top - center_y, bottom - center_y])
+    first = max(math.floor(ends.min()) - 1, 0)
+    last = min(math.ceil(ends.max()) + 1, height)
+    return np.arange(first, last)
+
+
+def scale_sprite(sprite, top, center_y, scales, rows):
+    '''Vertically scales the sprite around center_y once for every scale.
+    Returns an array of (scales, rows, width)
+
+    Every output row is the average of the sprite over the span of source
+    rows that it covers, which is what cairo would draw for a scaled text
+    '''
+    height = len(sprite)
+    # Integral of the sprite from its top edge, at every whole row
+    integral = np.concatenate([
+        np.zeros((1, sprite.shape[1]), dtype=np.float32),
+        np.cumsum(sprite, axis=0, dtype=np.float32)
+    ])
+
+    def integrate(edges):
+        x = np.clip(edges, 0, height)
+        k = np.minimum(np.floor(x), height - 1).astype(np.int64)
+        return integral[k] + (x - k)[:, :, None].astype(np.float32) * sprite[k]
+
+    # Top and bottom edges of every output row, in sprite rows
+    edges = center_y - top + (rows[None, :] - center_y) / scales[:, None]
+    step = 1 / scales[:, None, None]
+    scaled = (integrate(edges + step[:, :, 0]) - integrate(edges)) / step
+    return scaled.astype(np.float32)
+
+
+def layer_params(layer, times, duration):
+    '''Vertical scale and clipped alpha of a text layer for every frame'''
+    scales = np.array([layer.scaler_func(t, duration) for t in times])
+    alphas = np.array([
+        0 if t == layer.skip_if_t else layer.alpha_func(t, duration)
+        for t in times
+    ])
+    return scales, np.clip(alphas, 0, 1).astype(np.float32)
+
+
+def render_transition(
+    constants, n, settings, next_settings, terminal_settings,
+    old, new, old_next, new_next, old_term, new_term, service_settings,
+    old_service, new_service, fps, chunk_size=8, arrow_moves=True
+):
+    '''Returns every frame of a transition as a (frames, height, width, 3)
+    array, the same frames as make_frames() would draw one at a time
+
+    Frames are blended chunk_size at a time to bound the memory used for
+    intermediate float arrays
+    '''
+    width, height = constants.width, constants.height
+    duration = constants.duration
+    times = frame_times(duration, fps)
+
+    # Layers that are the same in every frame, which only leaves out the
+    # arrow and the transfer labels if they are animated
+    arrow = arrow_layer(constants, settings, n, arrow_moves)
+    transfers = transfer_layer(
+        constants, settings, n, station_language(settings[n], old)
+    )
+    background = make_surface(width, height, bg_color=(1,1,1))
+    draw_background(background, constants, service_settings)
+    static = make_surface(width, height, bg_color=(1,1,1))
+    draw_background(static, constants, service_settings)
+    draw_foreground(
+        static, constants, settings, n, terminal_settings, arrow is None,
+        transfers is None
+    )
+    foreground = make_surface(width, height)
+    draw_foreground(
+        foreground, constants, settings, n, terminal_settings, arrow is None,
+        transfers is None
+    )
+
+    frames = np.empty((len(times), height, width, 3), dtype=np.uint8)
+    frames[:] = static.get_npimage()
+
+    sprites = []
+    for layer in make_text_layers(
+        constants, n, settings, next_settings, terminal_settings,
+        old, new, old_next, new_next, old_term, new_term, service_settings,
+        old_service, new_service
+    ):
+        if (sprite := text_sprite(layer, width, height)) is None:
+            continue
+        scales, alphas = layer_params(layer, times, duration)
+        rows = scaled_rows(
+            sprite[0], sprite[1], layer.center_xy[1], scales, height
+        )
+        sprites.append((layer, sprite, scales, alphas, rows))
+
+    if sprites:
+        blend_texts(
+            frames, sprites, background, foreground, times, chunk_size
+        )
+    blend_layers(frames, transfers, arrow, times, duration)
+    return frames
+
+
+def blend_texts(frames, sprites, background, foreground, times, chunk_size):
+    '''Blends the scaled text sprites between the background and the
+    foreground of every frame, in the box around all texts
+    '''
+    # Only the box around all texts changes between frames
+    row_start = min(rows[0] for *_, rows in sprites)
+    row_end = max(rows[-1] for *_, rows in sprites) + 1
+    col_start = min(sprite[2] for _, sprite, *_ in sprites)
+    col_end = max(sprite[2] + sprite[0].shape[1] for _, sprite, *_ in sprites)
+    box = np.s_[row_start:row_end, col_start:col_end]
+
+    bg = background.get_npimage()[box].astype(np.float32)
+    fg = foreground.get_npimage(transparent=True)[box].astype(np.float32)
+    fg_rgb, fg_alpha = fg[:, :, :3], fg[:, :, 3:] / 255
+
+    for chunk in np.array_split(
+        np.arange(len(times)), math.ceil(len(times) / chunk_size)
+    ):
+        canvas = np.repeat(bg[None], len(chunk), axis=0)
+        for layer, (sprite, top, left), scales, alphas, rows in sprites:
+            alpha = scale_sprite(
+                sprite, top, layer.center_xy[1], scales[chunk], rows
+            )
+            alpha *= alphas[chunk, None, None]
+            alpha = alpha[:, :, :, None]
+            region = canvas[
+                :,
+                rows[0] - row_start:rows[-1] + 1 - row_start,
+                left - col_start:left + sprite.shape[1] - col_start
+            ]
+            color = np.array(layer.fontcolor[:3], dtype=np.float32) * 255
+            region *= 1 - alpha
+            region += color * alpha
+
+        # Premultiplied foreground over the texts
+        canvas *= 1 - fg_alpha
+        canvas += fg_rgb
+        frames[(chunk, *box)] = np.clip(canvas + 0.5, 0, 255).astype(np.uint8)
+
+
+def blend_layers(frames, transfers, arrow, times, duration):
+    '''Draws the TransferLayer and the ArrowLayer (either can be None) over
+    every frame, on a surface the size of what they draw
+    '''
+    boxes = []
+    if transfers is not None:
+        boxes.append(transfer_box(transfers, get_backend()))
+    if arrow is not None:
+        boxes.append(arrow_box(arrow))
+    boxes = [box for box in boxes if box is not None]
+    if not boxes:
+        return
+
+    height, width = frames.shape[1:3]
+    left = max(math.floor(min(box[0] for box in boxes)), 0)
+    top = max(math.floor(min(box[1] for box in boxes)), 0)
+    right = min(math.ceil(max(box[2] for box in boxes)), width)
+    bottom = min(math.ceil(max(box[3] for box in boxes)), height)
+    box = np.s_[top:bottom, left:right]
+    for frame, t in zip(frames, times):
+        surface = make_surface(right - left, bottom - top)
+        if transfers is not None:
+            draw_transfer_layer(
+                surface, transfers, *transfer_alphas(t, duration),
+                origin=(left, top)
+            )
+        if arrow is not None:
+            draw_arrow_layer(surface, arrow, t, duration, origin=(left, top))
+        layers = surface.get_npimage(transparent=True).astype(np.float32)
+        # Premultiplied layers over the frame
+        region = frame[box] * (1 - layers[:, :, 3:] / 255) + layers[:, :, :3]
+        frame[box] = np.clip(region + 0.5, 0, 255).astype(np.uint8)
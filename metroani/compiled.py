@@ -0,0 +1,255 @@
+'''Compiled settings: settings JSON in a compact binary form that loads fast
+
+    python -m metroani.compiled settings/full.json
+
+writes settings/full.compiled. settings_from_json() loads it instead of the
+JSON as long as the JSON did not change since it was compiled, which is
+checked with a content hash of the JSON.
+
+Stations are stored as columns: every string is stored once in a table and
+referred to by its index, and numbers and coordinates are stored in arrays
+that are memory-mapped when loading. Everything else is small and stored as
+JSON in the header
+'''
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+
+import numpy as np
+
+from .s_types import (
+    Constants, Transition, StationTransition, TerminusTransition,
+    StationTranslation, LineTranslation
+)
+
+__all__ = ['compile_settings', 'load_compiled', 'compiled_path']
+
+MAGIC = b'METROANI'
+VERSION = 1
+ALIGNMENT = 8  # Bytes, for the arrays
+
+
+def compiled_path(settings_path):
+    '''Where the compiled settings of a settings file are stored'''
+    return os.path.splitext(settings_path)[0] + '.compiled'
+
+
+def source_hash(source):
+    return hashlib.sha256(source).hexdigest()
+
+
+def number_columns(name, values):
+    '''Columns of numbers, as floats and whether each of them was an int so
+    that they load as the same type
+    '''
+    return {
+        name: np.array(values, dtype=np.float64),
+        name + '.int': np.array(
+            [type(value) is int for value in values], dtype=np.uint8
+        ),
+    }
+
+
+def xy_columns(name, values):
+    '''Columns of coordinates, flattened to x, y, x, y...'''
+    for xy in values:
+        if len(xy) != 2:
+            raise ValueError(f'Expected [x, y] for {name}, got {xy}')
+    return number_columns(name, [v for xy in values for v in xy])
+
+
+def offsets(lengths):
+    '''Where every group starts in a flat column, and where the last ends'''
+    return np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)])
+
+
+def station_columns(stations):
+    '''Every array of the stations section, with its strings interned'''
+    strings = {}
+
+    def intern(values):
+        return np.array(
+            [strings.setdefault(value, len(strings)) for value in values],
+            dtype=np.int32
+        )
+
+    names = [t for station in stations for t in station['translations']]
+    lines = [line for station in stations for line in station['transfers']]
+    line_names = [t for line in lines for t in line]
+    columns = {
+        'station_number': intern([s['station_number'] for s in stations]),
+        'skip': np.array([s['skip'] for s in stations], dtype=np.uint8),
+        'names_start': offsets([len(s['translations']) for s in stations]),
+        'lines_start': offsets([len(s['transfers']) for s in stations]),
+        **xy_columns('xy', [s['xy'] for s in stations]),
+
+        'name': intern([t['name'] for t in names]),
+        'font': intern([t['font'] for t in names]),
+        **number_columns('fontsize', [t['fontsize'] for t in names]),
+        **number_columns('scale_x', [t['scale_x'] for t in names]),
+        **xy_columns('enter_xy', [t['enter_xy'] for t in names]),
+        **xy_columns('exit_xy', [t['exit_xy'] for t in names]),
+
+        'line_names_start': offsets([len(line) for line in lines]),
+        'line_name': intern([t['name'] for t in line_names]),
+        'line_font': intern([t['font'] for t in line_names]),
+        **number_columns(
+            'line_fontsize', [t['fontsize'] for t in line_names]
+        ),
+        **number_columns(
+            'line_scale_x', [t['scale_x'] for t in line_names]
+        ),
+    }
+    # Names never contain NUL, so they can be split on it in one call
+    columns['strings'] = np.frombuffer(
+        '\0'.join(strings).encode('utf-8'), dtype=np.uint8
+    )
+    return columns
+
+
+def compile_settings(path, output=None):
+    '''Compiles a settings file, to output or next to it. Returns the path
+    of the compiled settings
+    '''
+    output = output or compiled_path(path)
+    with open(path, 'rb') as f:
+        source = f.read()
+    settings = json.loads(source)
+
+    columns = station_columns(settings['stations'])
+    arrays = {}
+    position = 0
+    for name, column in columns.items():
+        arrays[name] = [column.dtype.str, column.size, position]
+        position += -(-column.nbytes // ALIGNMENT) * ALIGNMENT
+    header = json.dumps({
+        'source': source_hash(source),
+        'settings': {
+            key: value for key, value in settings.items() if key != 'stations'
+        },
+        'arrays': arrays,
+    }).encode('utf-8')
+    # Arrays start aligned after the header
+    header += b' ' * (-(len(MAGIC) + 8 + len(header)) % ALIGNMENT)
+
+    # Write-then-rename so that workers never load half a file
+    tmp = output + '.partial'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC + struct.pack('<II', VERSION, len(header)) + header)
+        for name, column in columns.items():
+            f.write(column.tobytes())
+            f.write(b'\0' * (-column.nbytes % ALIGNMENT))
+    os.replace(tmp, output)
+    return output
+
+
+def decode_numbers(arrays, name):
+    values = arrays[name].tolist()
+    is_int = arrays[name + '.int'].tolist()
+    return [int(v) if i else v for v, i in zip(values, is_int)]
+
+
+def decode_xy(arrays, name):
+    values = decode_numbers(arrays, name)
+    return [values[i:i + 2] for i in range(0, len(values), 2)]
+
+
+def decode_stations(arrays):
+    strings = arrays['strings'].tobytes().decode('utf-8').split('\0')
+
+    def lookup(name):
+        return [strings[idx] for idx in arrays[name].tolist()]
+
+    names = list(map(
+        StationTranslation, lookup('name'), lookup('font'),
+        decode_numbers(arrays, 'fontsize'), decode_numbers(arrays, 'scale_x'),
+        decode_xy(arrays, 'enter_xy'), decode_xy(arrays, 'exit_xy')
+    ))
+    line_names = list(map(
+        LineTranslation, lookup('line_name'), lookup('line_font'),
+        decode_numbers(arrays, 'line_fontsize'),
+        decode_numbers(arrays, 'line_scale_x')
+    ))
+    line_starts = arrays['line_names_start'].tolist()
+    lines = [
+        line_names[start:end]
+        for start, end in zip(line_starts, line_starts[1:])
+    ]
+    name_starts = arrays['names_start'].tolist()
+    lines_starts = arrays['lines_start'].tolist()
+    return [
+        StationTransition(
+            names[name_starts[i]:name_starts[i + 1]], xy, number,
+            lines[lines_starts[i]:lines_starts[i + 1]], bool(skip)
+        )
+        for i, (xy, number, skip) in enumerate(zip(
+            decode_xy(arrays, 'xy'), lookup('station_number'),
+            arrays['skip'].tolist()
+        ))
+    ]
+
+
+def load_compiled(path, source=None):
+    '''Loads compiled settings, the same as settings_from_json() would load
+    the settings file. Raises ValueError if the settings file was changed
+    since, if given its contents as source
+    '''
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    start = len(MAGIC) + 8
+    if data[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not compiled settings')
+    version, header_length = struct.unpack('<II', data[len(MAGIC):start])
+    if version != VERSION:
+        raise ValueError(f'{path} was compiled by another version')
+    header = json.loads(data[start:start + header_length])
+    if source is not None and header['source'] != source_hash(source):
+        raise ValueError(f'{path} was compiled from other settings')
+
+    start += header_length
+    arrays = {
+        name: np.frombuffer(
+            data, dtype=dtype, count=count, offset=start + offset
+        )
+        for name, (dtype, count, offset) in header['arrays'].items()
+    }
+    settings = header['settings']
+    return (
+        Constants(**settings['constants']),
+        decode_stations(arrays),
+        TerminusTransition.from_json(settings, 'terminal'),
+        [Transition.from_json(settings['states'], key)
+         for key in settings['states'].keys()],
+        Transition.from_json(settings, 'service_type')
+    )
+
+
+def cached_settings(path, source):
+    '''The compiled settings of the settings file, or None if they were not
+    compiled or are out of date
+    '''
+    if not os.path.exists(compiled := compiled_path(path)):
+        return None
+    try:
+        return load_compiled(compiled, source)
+    except ValueError as e:
+        print(f'{e}, loading {path} instead', file=sys.stderr)
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compiles settings files for fast loading'
+    )
+    parser.add_argument('settings', nargs='+')
+    args = parser.parse_args()
+    for path in args.settings:
+        print(compile_settings(path))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+'''Fitting texts into their boxes, instead of tuning scale_x, enter_xy and
+exit_xy by hand
+
+Texts are measured once with cairo, the same way that they are drawn, and
+every text that is wider than its box is squeezed horizontally around its
+center. Texts enter from their top and exit to their bottom.
+'''
+import sys
+from functools import lru_cache
+
+import cairocffi as cairo
+
+from .ft import join_text
+from .surface import font_face
+
+__all__ = ['fit_settings', 'text_extents']
+
+
+@lru_cache(maxsize=1)
+def measuring_context():
+    return cairo.Context(cairo.ImageSurface(cairo.FORMAT_ARGB32, 1, 1))
+
+
+@lru_cache(maxsize=4096)
+def text_extents(text, font, fontsize):
+    '''(x_bearing, y_bearing, width, height) of the text as it is drawn'''
+    ctx = measuring_context()
+    ctx.set_font_face(font_face(font))
+    ctx.set_font_size(fontsize)
+    return tuple(ctx.text_extents(text)[:4])
+
+
+def fit_text(text, font, fontsize, xy, box):
+    '''Horizontal scale that keeps the text at xy inside the box (left and
+    right edges), and where its enter and exit transitions are centered.
+    Returns None if xy is outside of the box
+    '''
+    left, right = box
+    room = 2 * min(xy[0] - left, right - xy[0])
+    if room <= 0:
+        return None
+    _, _, width, height = text_extents(text, font, fontsize)
+    scale_x = min(1, room / width) if width else 1
+    # Texts are drawn with their center at xy
+    enter_xy = [xy[0], round(xy[1] - height / 2)]
+    exit_xy = [xy[0], round(xy[1] + height / 2)]
+    return scale_x, enter_xy, exit_xy
+
+
+def fit_translation(translation, xy, box, text=None):
+    '''StationTranslation fitted into the box, as the text that is drawn
+    with it, its name by default
+    '''
+    text = translation.name if text is None else text
+    if (fitted := fit_text(
+        text, translation.font, translation.fontsize, xy, box
+    )) is None:
+        print(
+            f'{text} at {xy} is outside of {box}, not fitting it',
+            file=sys.stderr
+        )
+        return translation
+    scale_x, enter_xy, exit_xy = fitted
+    return translation._replace(
+        scale_x=scale_x, enter_xy=enter_xy, exit_xy=exit_xy
+    )
+
+
+def fit_terminus(translation, xy, box):
+    '''TerminusTranslation fitted into the box, both on its own at its xy and
+    joined with the terminus at the xy of the terminal settings
+    '''
+    alone = fit_text(
+        translation.name, translation.font, translation.fontsize,
+        translation.xy, box
+    )
+    combined = fit_text(
+        join_text(translation), translation.font, translation.fontsize, xy,
+        box
+    )
+    if alone is None or combined is None:
+        print(
+            f'{join_text(translation)} is outside of {box}, not fitting it',
+            file=sys.stderr
+        )
+        return translation
+    return translation._replace(
+        # Both texts are drawn with the same scale
+        scale_x=min(alone[0], combined[0]),
+        enter_xy=alone[1], exit_xy=alone[2],
+        combined_enter_xy=combined[1], combined_exit_xy=combined[2],
+    )
+
+
+def fit_transition(transition, box):
+    return transition._replace(names=[
+        fit_translation(translation, transition.xy, box)
+        for translation in transition.names
+    ])
+
+
+def fit_direction(station, terminal_settings, box):
+    '''First station fitted into the box, when show_direction draws the
+    direction (the terminus text of the terminal settings in the same
+    language) instead of its name
+    '''
+    terms = terminal_settings.names
+    return station._replace(names=[
+        fit_translation(
+            translation, station.xy, box, terms[idx % len(terms)].terminus
+        )
+        for idx, translation in enumerate(station.names)
+    ])
+
+
+def fit_settings(
+    constants, station_settings, terminal_settings, state_settings,
+    service_settings, margin=40, station_box=None, box=None
+):
+    '''Returns the settings with the scale_x, enter_xy and exit_xy of every
+    station, terminus, state and service type translation fitted
+
+    Station names are fitted between the station icon and the right edge of
+    the video (or station_box), other texts between the left and right edges
+    (or box), with a margin. Boxes are (left, right) x coordinates. With
+    show_direction, the first station is fitted as the direction
+    '''
+    if station_box is None:
+        icon_right = constants.icon_xy[0] + constants.icon_size
+        station_box = (icon_right + margin, constants.width - margin)
+    if box is None:
+        box = (margin, constants.width - margin)
+
+    terminal_settings = terminal_settings._replace(names=[
+        fit_terminus(translation, terminal_settings.xy, box)
+        for translation in terminal_settings.names
+    ])
+    stations = [
+        fit_transition(station, station_box) for station in station_settings
+    ]
+    if constants.show_direction and stations:
+        stations[0] = fit_direction(
+            station_settings[0], terminal_settings, station_box
+        )
+    return (
+        constants,
+        stations,
+        terminal_settings,
+        [fit_transition(state, box) for state in state_settings],
+        fit_transition(service_settings, box),
+    )
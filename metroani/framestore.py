@@ -0,0 +1,121 @@
+'''Rendered frames kept on disk, for encoding the same video many times'''
+import json
+import os
+import time
+
+import numpy as np
+
+from .render import frame_ranges, frames_key, segment_frames
+
+__all__ = ['FrameStore']
+
+
+class FrameStore:
+    '''Raw frames of every rendered segment, in one file per segment that is
+    memory-mapped when read, keyed by the content hash of the frames
+
+    Pass it as the cache of stream_video(), so that encoding the same video
+    again with other encoder settings reads the frames instead of rendering
+    them. The least recently used segments are deleted when the files take
+    more than budget bytes
+    '''
+    def __init__(self, directory, budget=20 * 2**30):
+        self.directory = directory
+        self.budget = budget
+        # Counted in segments
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+        for filename in os.listdir(directory):
+            if filename.endswith('.partial'):
+                # Left over from a render that was interrupted
+                os.remove(os.path.join(directory, filename))
+
+        try:
+            with open(self.index_path(), 'r') as f:
+                index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+        self.index = {
+            key: entry for key, entry in index.items()
+            if os.path.exists(self.path(key))
+        }
+
+    def index_path(self):
+        return os.path.join(self.directory, 'index.json')
+
+    def path(self, key):
+        return os.path.join(self.directory, key + '.raw')
+
+    def save_index(self):
+        # Write-then-rename so that a crash never leaves a half-written index
+        tmp = self.index_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f, indent=4)
+        os.replace(tmp, self.index_path())
+
+    def size(self):
+        '''Total bytes of the stored frames'''
+        return sum(np.prod(entry['shape']) for entry in self.index.values())
+
+    def evict(self):
+        total = self.size()
+        for key, entry in sorted(self.index.items(), key=lambda e: e[1]['used']):
+            if total <= self.budget:
+                break
+            os.remove(self.path(key))
+            del self.index[key]
+            total -= np.prod(entry['shape'])
+
+    def read(self, key):
+        entry = self.index[key]
+        entry['used'] = time.time()
+        self.save_index()
+        return np.memmap(
+            self.path(key), dtype=np.uint8, mode='r', shape=tuple(entry['shape'])
+        )
+
+    def write(self, key, frames, count):
+        '''Stores the frames while passing them on'''
+        tmp = self.path(key) + '.partial'
+        store = None
+        for idx, frame in enumerate(frames):
+            if store is None:
+                store = np.memmap(
+                    tmp, dtype=np.uint8, mode='w+',
+                    shape=(count,) + frame.shape
+                )
+            store[idx] = frame
+            yield frame
+        if store is None:
+            return
+        shape = store.shape
+        store.flush()
+        del store
+        os.replace(tmp, self.path(key))
+        self.index[key] = {'shape': shape, 'used': time.time()}
+        self.evict()
+        self.save_index()
+
+    def segment_frames(self, segment, settings, frames, fps):
+        '''Same frames as render.segment_frames(), read from the store if they
+        were rendered before
+        '''
+        station_settings, terminal_settings, constants, service_settings = settings
+        key = frames_key(
+            segment, frames, fps, constants, station_settings,
+            terminal_settings, service_settings
+        )
+        if key in self.index:
+            self.hits += 1
+            yield from self.read(key)
+        else:
+            self.misses += 1
+            yield from self.write(
+                key, segment_frames(segment, settings, frames, fps), len(frames)
+            )
+
+    def stream_frames(self, segments, settings, fps):
+        '''Same frames as render.stream_frames()'''
+        for segment, frames in frame_ranges(segments, fps):
+            yield from self.segment_frames(segment, settings, frames, fps)
@@ -1,5 +1,7 @@
 '''Functions of time that draws animation frames'''
-import gizeh as gz
+from __future__ import annotations
+from functools import partial
+from typing import NamedTuple
 
 from cytoolz import curry
 
@@ -11,9 +13,18 @@ from .graphics import (
     draw_tokyu_frames,
     make_line_info,
     make_station_icon,
+    ArrowLayer,
+    TransferLayer,
+    arrow_layer,
+    draw_arrow_layer,
+    draw_transfer_layer,
+    transfer_layer,
 )
+from .surface import RecordingSurface, get_backend, unpremultiply
 
-__all__ = ['make_frames']
+__all__ = [
+    'make_frames', 'plan_frames', 'compile_plan', 'draw_plan', 'TextLayer'
+]
 
 
 def thresholdify_beginning(pivot, constant_value):
@@ -92,6 +103,22 @@ def hide_text_alpha(t, duration):
     return -2*t + 2*duration
 
 
+class TextLayer(NamedTuple):
+    '''A text that is scaled and faded as a function of time.
+    Fields are in the same order as the arguments of make_scale_text_frames
+    '''
+    skip_if_t: float
+    scaler_func: 'func[T, T] -> T'
+    text: str
+    xy: list[int]
+    font: str
+    fontsize: int
+    fontcolor: tuple[float]
+    x_scale: float
+    center_xy: list[int]
+    alpha_func: 'func[T, T] -> T'
+
+
 def make_scale_text_frames(
     t, duration, surface, skip_if_t, scaler_func,
     text, xy, font, fontsize, fontcolor, x_scale,
@@ -101,91 +128,100 @@ def make_scale_text_frames(
     if t != skip_if_t:
         color = list(fontcolor) + [alpha_func(t, duration)]
         scaler = scaler_func(t, duration)
-        new = gz.text(text, font, fontsize, xy=xy, fill=color)
-        new.scale(rx=x_scale, ry=scaler, center=center_xy).draw(surface)
+        surface.text(
+            text, font, fontsize, xy=xy, fill=color, scale_x=x_scale,
+            scale_y=scaler, center=center_xy
+        )
     return surface
 
 
-def make_show_text_frames(
-    t, duration, surface, new_text, xy, new_font, new_fontsize,
-    fontcolor, new_scale_x, new_center_xy
+def at_start(f):
+    '''Freezes a function of time at t = 0'''
+    def g(_, d):
+        return f(0, d)
+    return g
+
+
+def show_text_layer(
+    duration, new_text, xy, new_font, new_fontsize, fontcolor, new_scale_x,
+    new_center_xy
 ):
-    return make_scale_text_frames(
-        t, duration, surface, 0, show_text_scaler, new_text, xy, new_font,
-        new_fontsize, fontcolor, new_scale_x, new_center_xy, show_text_alpha
+    return TextLayer(
+        0, show_text_scaler, new_text, xy, new_font, new_fontsize, fontcolor,
+        new_scale_x, new_center_xy, show_text_alpha
     )
 
 
-def make_hide_text_frames(
-    t, duration, surface, old_text, xy, old_font, old_fontsize, fontcolor,
-    old_scale_x, old_center_xy
+def hide_text_layer(
+    duration, old_text, xy, old_font, old_fontsize, fontcolor, old_scale_x,
+    old_center_xy
 ):
-    return make_scale_text_frames(
-        t, duration, surface, duration, hide_text_scaler, old_text, xy, old_font,
-        old_fontsize, fontcolor, old_scale_x, old_center_xy, hide_text_alpha
+    return TextLayer(
+        duration, hide_text_scaler, old_text, xy, old_font, old_fontsize,
+        fontcolor, old_scale_x, old_center_xy, hide_text_alpha
     )
 
 
-def make_text_frames(
-    t, duration, surface, new_text, old_text, show_xy, new_font, old_font,
+def text_layers(
+    duration, new_text, old_text, show_xy, new_font, old_font,
     new_fontsize, old_fontsize, fontcolor, old_scale_x, new_scale_x,
     new_center_xy, old_center_xy, hide_xy=None
 ):
-    '''Draws one text showing animation and one text hiding animation'''
+    '''One text showing animation and one text hiding animation'''
     # If both texts are the same, no animation is needed
     if new_text == old_text:
-        return make_hide_text_frames(
-            0, duration, surface, old_text, show_xy, old_font, old_fontsize, fontcolor,
-            old_scale_x, old_center_xy
-        )
-
-    make_show_text_frames(
-        t, duration, surface, new_text, show_xy, new_font, new_fontsize,
-        fontcolor, new_scale_x, new_center_xy
-    )
+        return [TextLayer(
+            None, at_start(hide_text_scaler), old_text, show_xy, old_font,
+            old_fontsize, fontcolor, old_scale_x, old_center_xy,
+            at_start(hide_text_alpha)
+        )]
 
     if hide_xy is None:
         hide_xy = show_xy
-    make_hide_text_frames(
-        t, duration, surface, old_text, hide_xy, old_font, old_fontsize, fontcolor,
-        old_scale_x, old_center_xy
-    )
-    return surface
+    return [
+        show_text_layer(
+            duration, new_text, show_xy, new_font, new_fontsize, fontcolor,
+            new_scale_x, new_center_xy
+        ),
+        hide_text_layer(
+            duration, old_text, hide_xy, old_font, old_fontsize, fontcolor,
+            old_scale_x, old_center_xy
+        ),
+    ]
 
 
-def make_text_frames_from_setting(t, constants, surface, settings, old, new, color):
-    make_text_frames(
-        t, constants.duration, surface, new.name, old.name,
+def text_layers_from_setting(constants, settings, old, new, color):
+    return text_layers(
+        constants.duration, new.name, old.name,
         settings.xy, new.font, old.font,
         new.fontsize, old.fontsize, color,
         old.scale_x, new.scale_x, new.enter_xy,
         old.exit_xy
     )
-    return surface
 
 
-def make_text_frames_simple(
-    t, constants, surface, new_text, old_text, show_xy,
+def text_layers_simple(
+    constants, new_text, old_text, show_xy,
     new, old, fontcolor, old_scale_x, new_scale_x,
     new_center_xy, old_center_xy, hide_xy=None
 ):
-    '''More complicated than make_text_frames_from_setting but less than
-    make_text_frames
+    '''More complicated than text_layers_from_setting but less than
+    text_layers
     '''
-    return make_text_frames(
-        t, constants.duration, surface, new_text, old_text, show_xy,
+    return text_layers(
+        constants.duration, new_text, old_text, show_xy,
         new.font, old.font, new.fontsize, old.fontsize, fontcolor,
         old.scale_x, new.scale_x, new_center_xy, old_center_xy,
         hide_xy=hide_xy
     )
 
 
-def make_direction_text(t, n, constants, surface, new_term, old_term, settings,
-                        new, old, color):
+def direction_text_layers(n, constants, new_term, old_term, settings, new, old,
+                          color):
     new_text = new_term.terminus
     old_text = old_term.terminus
-    make_text_frames_simple(
-        t, constants, surface, new_text, old_text,
+    return text_layers_simple(
+        constants, new_text, old_text,
         settings[n].xy, new, old, color, old.scale_x, new.scale_x,
         new.enter_xy, old.exit_xy
     )
@@ -197,32 +233,48 @@ def join_text(term):
     return ' '.join([term.name, term.terminus])
 
 
-@curry
-def make_frames(
-    t, constants, n, settings, next_settings, terminal_settings,
-    old, new, old_next, new_next, old_term, new_term, service_settings,
-    old_service, new_service
-):
-    '''Returns the frames from the transition of three texts as a function of time'''
-    surface = gz.Surface(constants.width, constants.height, bg_color=(1,1,1))
-
-    # Apply theme
+def theme_functions(constants):
+    '''The functions that draw the background and the text of the theme'''
     case = {
-        'metro': (draw_metro_frames, draw_metro_text),
-        'yamanote': (draw_yamanote_frames, draw_yamanote_text),
-        'jr': (draw_jr_frames, draw_jr_text),
-        'tokyu': (draw_tokyu_frames, draw_tokyu_text),
+        'metro': (draw_metro_frames, metro_text_layers),
+        'yamanote': (draw_yamanote_frames, yamanote_text_layers),
+        'jr': (draw_jr_frames, jr_text_layers),
+        'tokyu': (draw_tokyu_frames, tokyu_text_layers),
     }
-    if (funcs := case.get(constants.theme.lower(), None)):
+    return case.get(constants.theme.lower(), None)
+
+
+def draw_background(surface, constants, service_settings):
+    '''Draws everything that is behind the text'''
+    if (funcs := theme_functions(constants)):
         funcs[0](surface, constants, service_settings)
-        funcs[1](
-            t, constants, surface, n, new_term, old_term, terminal_settings,
+    return surface
+
+
+def make_text_layers(
+    constants, n, settings, next_settings, terminal_settings,
+    old, new, old_next, new_next, old_term, new_term, service_settings,
+    old_service, new_service
+):
+    '''Every text that is animated in a transition'''
+    if (funcs := theme_functions(constants)):
+        return funcs[1](
+            constants, n, new_term, old_term, terminal_settings,
             settings, new, old, next_settings, old_next, new_next,
             service_settings, old_service, new_service
         )
+    return []
 
+
+def draw_foreground(
+    surface, constants, settings, n, terminal_settings, arrow=True,
+    transfers=True
+):
+    '''Draws everything that is in front of the text, except the arrow or
+    the transfer labels of the line info if they are False
+    '''
     # Line info graphics
-    make_line_info(surface, constants, settings, n)
+    make_line_info(surface, constants, settings, n, arrow, transfers)
 
     # Station icon
     if n == 0 and constants.show_direction:
@@ -233,142 +285,281 @@ def make_frames(
     else:
         make_station_icon(surface, settings, n, constants)
 
-    return surface.get_npimage()
+    return surface
 
 
-def draw_metro_text(
-    t, constants, surface, n, new_term, old_term, terminal_settings,
-    settings, new, old, next_settings, old_next, new_next,
-    service_settings, old_service, new_service
-):
-    make_station_text(
-        t, constants, n, surface, new_term, old_term, settings, new, old,
-        color=(0, 0, 0)
-    )
-    make_next_text(
-        t, n, constants, surface, next_settings, old_next, new_next,
-        color=(0, 0, 0)
-    )
-    make_service_text(
-        t, constants, surface, service_settings,
-        old_service, new_service, color=(1, 1, 1)
-    )
-    draw_terminus_text(
-        t, n, constants, surface, new_term, old_term, terminal_settings,
-        color=(0, 0, 0)
+def station_language(setting, translation):
+    '''Index of the language of a translation of the station name'''
+    if translation in setting.names:
+        return setting.names.index(translation)
+    return 0
+
+
+def transfer_alphas(t, duration):
+    '''Alphas of the transfer labels in the old and the new language, which
+    fade like the station name
+    '''
+    return (
+        min(max(hide_text_alpha(t, duration), 0), 1),
+        min(max(show_text_alpha(t, duration), 0), 1),
     )
 
 
-def draw_yamanote_text(
-    t, constants, surface, n, new_term, old_term, terminal_settings,
-    settings, new, old, next_settings, old_next, new_next,
-    service_settings, old_service, new_service
+class RenderPlan(NamedTuple):
+    '''Everything that is drawn in a transition, with every branch on the
+    settings resolved, so that drawing a frame only calls the backend
+    '''
+    backend: type  # Surface class that the operations are methods of
+    width: int
+    height: int
+    scale: float
+    duration: float
+    # (method of the backend, args, kwargs), drawn behind and in front of
+    # the text
+    background: tuple
+    text_layers: tuple[TextLayer]
+    foreground: tuple
+    # Drawn in front of everything, or None
+    transfers: TransferLayer
+    arrow: ArrowLayer
+
+
+def compile_plan(
+    constants, n, settings, next_settings, terminal_settings,
+    old, new, old_next, new_next, old_term, new_term, service_settings,
+    old_service, new_service, scale=1, arrow_moves=True
 ):
-    make_station_text(
-        t, constants, n, surface, new_term, old_term, settings, new, old,
-        color=Yamanote.bg_color
-    )
-    make_next_text(
-        t, n, constants, surface, next_settings, old_next, new_next,
-        color=Yamanote.bg_color
+    '''Compiles a transition into a RenderPlan, drawn with draw_plan(). The
+    arrow only moves from the previous station if arrow_moves, see
+    Segment.arrow_moves
+    '''
+    backend = get_backend()
+    background = RecordingSurface(backend, scale)
+    draw_background(background, constants, service_settings)
+    # The arrow and the transfer labels are only drawn on every frame when
+    # they are animated, the rest of the foreground stays the same
+    arrow = arrow_layer(constants, settings, n, arrow_moves)
+    transfers = transfer_layer(
+        constants, settings, n, station_language(settings[n], old)
     )
-    make_service_text(
-        t, constants, surface, service_settings,
-        old_service, new_service, color=constants.line_color
+    foreground = RecordingSurface(backend, scale)
+    draw_foreground(
+        foreground, constants, settings, n, terminal_settings, arrow is None,
+        transfers is None
     )
-    draw_terminus_text(
-        t, n, constants, surface, new_term, old_term, terminal_settings,
-        color=Yamanote.bg_color
+    return RenderPlan(
+        backend, constants.width, constants.height, scale,
+        constants.duration, tuple(background.operations),
+        tuple(make_text_layers(
+            constants, n, settings, next_settings, terminal_settings,
+            old, new, old_next, new_next, old_term, new_term,
+            service_settings, old_service, new_service
+        )),
+        tuple(foreground.operations), transfers, arrow
     )
 
 
-def draw_jr_text(
-    t, constants, surface, n, new_term, old_term, terminal_settings,
-    settings, new, old, next_settings, old_next, new_next,
-    service_settings, old_service, new_service
-):
-    make_station_text(
-        t, constants, n, surface, new_term, old_term, settings, new, old,
-        color=JR.station_font_color
-    )
-    make_next_text(
-        t, n, constants, surface, next_settings, old_next, new_next,
-        color=(0, 0, 0)
-    )
-    make_service_text(
-        t, constants, surface, service_settings,
-        old_service, new_service, color=(0, 0, 0)
-        #Should be constants.line_color but need stroke
+def draw_plan(plan, t, overlay=False):
+    '''Draws the frame of a compiled transition at time t
+
+    If overlay is True, the background is left out and the frame is RGBA
+    with a transparent background, to be composited over draw_still()
+    '''
+    if overlay:
+        surface = plan.backend(plan.width, plan.height, plan.scale)
+    else:
+        surface = plan.backend(
+            plan.width, plan.height, plan.scale, bg_color=(1,1,1)
+        )
+        for method, args, kwargs in plan.background:
+            method(surface, *args, **kwargs)
+    for layer in plan.text_layers:
+        make_scale_text_frames(t, plan.duration, surface, *layer)
+    for method, args, kwargs in plan.foreground:
+        method(surface, *args, **kwargs)
+    if plan.transfers is not None:
+        draw_transfer_layer(
+            surface, plan.transfers, *transfer_alphas(t, plan.duration)
+        )
+    if plan.arrow is not None:
+        draw_arrow_layer(surface, plan.arrow, t, plan.duration)
+    if overlay:
+        return unpremultiply(surface.get_npimage(transparent=True))
+    return surface.get_npimage()
+
+
+def draw_still(constants, service_settings, scale=1):
+    '''Draws the background, which is the same in every frame of a video'''
+    surface = get_backend()(
+        constants.width, constants.height, scale, bg_color=(1,1,1)
     )
-    draw_terminus_text(
-        t, n, constants, surface, new_term, old_term, terminal_settings,
-        color=(0, 0, 0)
+    return draw_background(surface, constants, service_settings).get_npimage()
+
+
+def plan_frames(scale=1, overlay=False, **transition):
+    '''Function of time that draws the frames of a transition, which takes
+    the same arguments as make_frames() except t
+    '''
+    return partial(
+        draw_plan, compile_plan(scale=scale, **transition), overlay=overlay
     )
 
 
-def draw_tokyu_text(
-    t, constants, surface, n, new_term, old_term, terminal_settings,
-    settings, new, old, next_settings, old_next, new_next,
-    service_settings, old_service, new_service
+@curry
+def make_frames(
+    t, constants, n, settings, next_settings, terminal_settings,
+    old, new, old_next, new_next, old_term, new_term, service_settings,
+    old_service, new_service, scale=1, arrow_moves=True
 ):
-    make_station_text(
-        t, constants, n, surface, new_term, old_term, settings, new, old,
-        color=Tokyu.station_color
-    )
-    make_next_text(
-        t, n, constants, surface, next_settings, old_next, new_next,
-        color=Tokyu.station_color
-    )
-    make_service_text(
-        t, constants, surface, service_settings,
-        old_service, new_service, color=(1, 1, 1)
-    )
-    draw_terminus_text(
-        t, n, constants, surface, new_term, old_term, terminal_settings,
-        color=Tokyu.station_color
-    )
+    '''Returns the frames from the transition of three texts as a function of time
+
+    The frames are scale times the size of the constants, drawn natively at
+    that resolution. The transition is compiled for every frame; use
+    plan_frames() to draw many frames of the same transition
+    '''
+    return draw_plan(compile_plan(
+        constants, n, settings, next_settings, terminal_settings,
+        old, new, old_next, new_next, old_term, new_term, service_settings,
+        old_service, new_service, scale, arrow_moves
+    ), t)
 
 
-def make_station_text(
-    t, constants, n, surface, new_term, old_term, settings, new, old, color
+def metro_text_layers(
+    constants, n, new_term, old_term, terminal_settings,
+    settings, new, old, next_settings, old_next, new_next,
+    service_settings, old_service, new_service
+):
+    return [
+        *station_text_layers(
+            constants, n, new_term, old_term, settings, new, old,
+            color=(0, 0, 0)
+        ),
+        *next_text_layers(
+            n, constants, next_settings, old_next, new_next,
+            color=(0, 0, 0)
+        ),
+        *service_text_layers(
+            constants, service_settings,
+            old_service, new_service, color=(1, 1, 1)
+        ),
+        *terminus_text_layers(
+            n, constants, new_term, old_term, terminal_settings,
+            color=(0, 0, 0)
+        ),
+    ]
+
+
+def yamanote_text_layers(
+    constants, n, new_term, old_term, terminal_settings,
+    settings, new, old, next_settings, old_next, new_next,
+    service_settings, old_service, new_service
+):
+    return [
+        *station_text_layers(
+            constants, n, new_term, old_term, settings, new, old,
+            color=Yamanote.bg_color
+        ),
+        *next_text_layers(
+            n, constants, next_settings, old_next, new_next,
+            color=Yamanote.bg_color
+        ),
+        *service_text_layers(
+            constants, service_settings,
+            old_service, new_service, color=constants.line_color
+        ),
+        *terminus_text_layers(
+            n, constants, new_term, old_term, terminal_settings,
+            color=Yamanote.bg_color
+        ),
+    ]
+
+
+def jr_text_layers(
+    constants, n, new_term, old_term, terminal_settings,
+    settings, new, old, next_settings, old_next, new_next,
+    service_settings, old_service, new_service
+):
+    return [
+        *station_text_layers(
+            constants, n, new_term, old_term, settings, new, old,
+            color=JR.station_font_color
+        ),
+        *next_text_layers(
+            n, constants, next_settings, old_next, new_next,
+            color=(0, 0, 0)
+        ),
+        *service_text_layers(
+            constants, service_settings,
+            old_service, new_service, color=(0, 0, 0)
+            #Should be constants.line_color but need stroke
+        ),
+        *terminus_text_layers(
+            n, constants, new_term, old_term, terminal_settings,
+            color=(0, 0, 0)
+        ),
+    ]
+
+
+def tokyu_text_layers(
+    constants, n, new_term, old_term, terminal_settings,
+    settings, new, old, next_settings, old_next, new_next,
+    service_settings, old_service, new_service
+):
+    return [
+        *station_text_layers(
+            constants, n, new_term, old_term, settings, new, old,
+            color=Tokyu.station_color
+        ),
+        *next_text_layers(
+            n, constants, next_settings, old_next, new_next,
+            color=Tokyu.station_color
+        ),
+        *service_text_layers(
+            constants, service_settings,
+            old_service, new_service, color=(1, 1, 1)
+        ),
+        *terminus_text_layers(
+            n, constants, new_term, old_term, terminal_settings,
+            color=Tokyu.station_color
+        ),
+    ]
+
+
+def station_text_layers(
+    constants, n, new_term, old_term, settings, new, old, color
 ):
     if n == 0 and constants.show_direction:
-        return make_direction_text(
-            t, n, constants, surface, new_term, old_term, settings, new, old,
-            color
+        return direction_text_layers(
+            n, constants, new_term, old_term, settings, new, old, color
         )
-    return make_text_frames_from_setting(
-        t, constants, surface, settings[n],
-        old, new, color
+    return text_layers_from_setting(
+        constants, settings[n], old, new, color
     )
 
 
-def make_next_text(
-    t, n, constants, surface, next_settings, old_next, new_next, color
-):
+def next_text_layers(n, constants, next_settings, old_next, new_next, color):
     if not (n == 0 and constants.show_direction):
-        make_text_frames_from_setting(
-            t, constants, surface, next_settings,
-            old_next, new_next, color
+        return text_layers_from_setting(
+            constants, next_settings, old_next, new_next, color
         )
+    return []
 
 
-def make_service_text(
-    t, constants, surface, service_settings, old_service, new_service, color
+def service_text_layers(
+    constants, service_settings, old_service, new_service, color
 ):
-    make_text_frames_from_setting(
-        t, constants, surface, service_settings,
-        old_service, new_service, color
+    return text_layers_from_setting(
+        constants, service_settings, old_service, new_service, color
     )
 
 
-def draw_terminus_text(
-    t, n, constants, surface, new_term, old_term, terminal_settings, color
+def terminus_text_layers(
+    n, constants, new_term, old_term, terminal_settings, color
 ):
     if n == 0 and constants.show_direction:
         # TODO: scale x should always be 0
-        return make_text_frames_simple(
-            t, constants, surface, new_term.name, old_term.name,
+        return text_layers_simple(
+            constants, new_term.name, old_term.name,
             new_term.xy, new_term, old_term, color,
             old_term.scale_x, new_term.scale_x, new_term.enter_xy,
             old_term.exit_xy, hide_xy=old_term.xy
@@ -377,8 +568,8 @@ def draw_terminus_text(
     new_text = join_text(new_term)
     old_text = join_text(old_term)
 
-    return make_text_frames_simple(
-        t, constants, surface, new_text, old_text, terminal_settings.xy,
+    return text_layers_simple(
+        constants, new_text, old_text, terminal_settings.xy,
         new_term, old_term, color, old_term.scale_x,
         new_term.scale_x, new_term.combined_enter_xy, old_term.combined_exit_xy
     )
@@ -0,0 +1,190 @@
+'''Golden frames: checks that changes to the renderer do not change its output
+
+A deterministic sample of frames of every bundled settings file is rendered
+in parallel, without rendering the videos, and compared to digests stored by
+an earlier run:
+
+    python -m metroani.golden --update   # Store the digests of this version
+    python -m metroani.golden            # Compare to the stored digests
+
+Every frame is hashed exactly, and also as the mean of every block of pixels
+so that frames that only differ by antialiasing noise are reported as close
+instead of changed. Digests depend on the installed cairo and fonts, so they
+are not committed: store them with --update on the machine that runs the
+check, before making changes
+'''
+import argparse
+import hashlib
+import json
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .ft import compile_plan, draw_plan
+from .metroani import settings_from_json
+from .surface import set_backend
+from .timeline import make_timeline
+
+__all__ = ['golden_frames', 'compare_golden']
+
+SETTINGS = [
+    'settings/gif.json',
+    'settings/joban.json',
+    'settings/keihin.json',
+    'settings/den_en_toshi.json',
+    'settings/full.json',
+]
+BLOCKS = (18, 32)  # Rows and columns of the block hash
+TOLERANCE = 2  # Largest difference of a block mean that is still close
+
+
+def sample_frames(timeline, duration, count, seed):
+    '''Segment index and time of count frames, the same on every run'''
+    rng = random.Random(seed)
+    count = min(count, len(timeline))
+    segments = sorted(rng.sample(range(len(timeline)), count))
+    # Both ends of the transition and somewhere in between
+    times = [0, duration, round(rng.uniform(0, duration), 3)]
+    return [(idx, times[i % len(times)]) for i, idx in enumerate(segments)]
+
+
+def block_hash(frame):
+    '''Mean of every block of the frame in grayscale, as hex'''
+    rows, cols = BLOCKS
+    gray = frame.mean(axis=2)
+    height, width = gray.shape
+    height, width = height - height % rows, width - width % cols
+    gray = gray[:height, :width]
+    blocks = gray.reshape(rows, height // rows, cols, width // cols)
+    means = blocks.mean(axis=(1, 3))
+    return np.round(means).astype(np.uint8).tobytes().hex()
+
+
+def render_golden(path, count, backend):
+    '''Digests of the sample frames of a settings file'''
+    set_backend(backend)
+    settings = settings_from_json(path)
+    constants, station_settings, terminal_settings, _, service_settings = (
+        settings
+    )
+    timeline = make_timeline(*settings)
+    digests = []
+    for idx, t in sample_frames(timeline, constants.duration, count, path):
+        segment = timeline[idx]
+        frame = draw_plan(compile_plan(
+            constants=constants, n=segment.n, settings=station_settings,
+            next_settings=segment.next_settings,
+            terminal_settings=terminal_settings,
+            old=segment.old, new=segment.new,
+            old_next=segment.old_next, new_next=segment.new_next,
+            old_term=segment.old_term, new_term=segment.new_term,
+            service_settings=service_settings,
+            old_service=segment.old_service, new_service=segment.new_service,
+            arrow_moves=segment.arrow_moves
+        ), t)
+        digests.append({
+            'segment': idx,
+            't': t,
+            'sha256': hashlib.sha256(frame.tobytes()).hexdigest(),
+            'blocks': block_hash(frame),
+        })
+    return digests
+
+
+def golden_frames(paths=SETTINGS, count=8, backend='gizeh', workers=None):
+    '''Digests of the sample frames of every settings file, by path'''
+    with ProcessPoolExecutor(workers) as pool:
+        results = pool.map(
+            render_golden, paths, [count] * len(paths),
+            [backend] * len(paths)
+        )
+        return dict(zip(paths, results))
+
+
+def compare_frame(expected, actual):
+    if expected is None:
+        return 'new'
+    if (expected['segment'], expected['t']) != (
+        actual['segment'], actual['t']
+    ):
+        # The timeline changed, so different frames were picked
+        return 'changed'
+    if expected['sha256'] == actual['sha256']:
+        return 'exact'
+    difference = np.abs(
+        np.frombuffer(bytes.fromhex(expected['blocks']), np.uint8).astype(int)
+        - np.frombuffer(bytes.fromhex(actual['blocks']), np.uint8)
+    )
+    return 'close' if difference.max() <= TOLERANCE else 'changed'
+
+
+def compare_golden(expected, actual):
+    '''Status of every frame: exact, close, changed or new. Returns a list of
+    (path, segment index, t, status)
+    '''
+    results = []
+    for path, digests in actual.items():
+        stored = expected.get(path, [])
+        for idx, digest in enumerate(digests):
+            status = compare_frame(
+                stored[idx] if idx < len(stored) else None, digest
+            )
+            results.append((path, digest['segment'], digest['t'], status))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Compares sample frames to stored digests'
+    )
+    parser.add_argument('--digests', default='golden.json')
+    parser.add_argument(
+        '--update', action='store_true',
+        help='Store the digests of the frames instead of comparing them'
+    )
+    parser.add_argument(
+        '--frames', type=int, default=8, help='Frames per settings file'
+    )
+    parser.add_argument('--backend', default='gizeh')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if not args.update:
+        try:
+            with open(args.digests, 'r') as f:
+                expected = json.load(f)
+        except FileNotFoundError:
+            # Nothing to compare to is a failure, not a pass
+            print(
+                f'{args.digests} not found, store digests with --update '
+                'first',
+                file=sys.stderr
+            )
+            sys.exit(1)
+
+    actual = golden_frames(
+        count=args.frames, backend=args.backend, workers=args.workers
+    )
+    if args.update:
+        with open(args.digests, 'w') as f:
+            json.dump(actual, f, indent=4)
+            f.write('\n')
+        return
+
+    results = compare_golden(expected, actual)
+    for path, segment, t, status in results:
+        if status != 'exact':
+            print(f'{path} segment {segment} at {t}s: {status}')
+    counts = {
+        status: sum(result[3] == status for result in results)
+        for status in ('exact', 'close', 'changed', 'new')
+    }
+    print(', '.join(f'{count} {status}' for status, count in counts.items()))
+    if counts['changed'] or counts['new']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,120 +1,310 @@
 '''Functions that draw graphics for every frame, given surface'''
-import gizeh as gz
+import math
+from functools import lru_cache
+from typing import NamedTuple
 
-from .utils import rgb, find_prev_unskipped_station
-from .s_types import Metro, Yamanote, JR, Tokyu
+import numpy as np
+
+from .surface import GizehSurface, surface_backend, surface_scale
+from .utils import (
+    rgb, station_window, line_continues, find_prev_unskipped_station
+)
+from .s_types import Constants, Metro, Yamanote, JR, Tokyu
+
+MAX_STATIONS = 8  # Stations shown in the line info
+ARROW_FILL = rgb([251, 3, 1])
+ARROW_FLASH = 0.6  # How much lighter the arrow gets when it flashes
+FADE_STEPS = 8  # Alphas that fading transfer labels are rasterized at
 
 
 def draw_metro_frames(surface, constants, service_settings):
     # Draw separator line
-    gz.polyline(
+    surface.polyline(
         [(0, constants.sep_height), (constants.width, constants.sep_height)],
         stroke=Metro.stroke_color, stroke_width=Metro.stroke_width
-    ).draw(surface)
+    )
 
     # Draw background for direction indicator
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width*2, ly=Metro.rectangle_height,
         xy=[0,0], fill=Metro.rectangle_fill
-    ).draw(surface)
+    )
 
     # Draw background for service type
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width/6, ly=Metro.rectangle_height/2 - 30,
         xy=[service_settings.xy[0], service_settings.xy[1]],
         fill=Metro.service_fill
-    ).draw(surface)
+    )
 
 
 def draw_yamanote_frames(surface, constants, service_settings):
     # Change background color
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width * 2, ly=constants.height * 2,
         fill=Yamanote.bg_color
-    ).draw(surface)
+    )
 
     # Fill station info in the top with background
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width, ly=constants.sep_height,
         xy=[constants.width/2,constants.sep_height/2],
         fill=Yamanote.rectangle_fill
-    ).draw(surface)
+    )
 
     # Add line color indicator
-    gz.rectangle(
+    surface.rectangle(
         lx=Yamanote.indicator_width, ly=constants.sep_height,
         xy=[Yamanote.indicator_pos, constants.sep_height/2],
         fill=constants.line_color
-    ).draw(surface)
+    )
 
     # Draw background for service type
-    gz.rectangle(
+    surface.rectangle(
         lx=(Yamanote.indicator_pos - Yamanote.indicator_width/2) - 50,
         ly=Metro.rectangle_height/2 - 30,
         xy=[service_settings.xy[0] + 10, service_settings.xy[1]],
         fill=Yamanote.bg_color
-    ).draw(surface)
+    )
 
 
 def draw_jr_frames(surface, constants, _):
     # Change background color
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width * 2, ly=constants.height * 2,
         fill=JR.bottom_bg_color
-    ).draw(surface)
+    )
 
     # Fill station info in the top with background
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width, ly=constants.sep_height,
         xy=[constants.width/2,constants.sep_height/2],
         fill=JR.top_bg_color
-    ).draw(surface)
+    )
 
     # Fill station text with background
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width * JR.box_width_mul,
         ly=constants.sep_height * JR.box_height_mul,
         xy=[constants.width/2, constants.sep_height/2 + 50],
         fill=JR.station_bg_color
-    ).draw(surface)
+    )
 
 
 def draw_tokyu_frames(surface, constants, service_settings):
     # Change background color
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width * 2, ly=constants.height * 2,
         fill=Tokyu.bg_color
-    ).draw(surface)
+    )
 
     # Fill station info in the top with background
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width, ly=constants.sep_height,
         xy=[constants.width/2,constants.sep_height/2],
         fill=Tokyu.rectangle_fill
-    ).draw(surface)
+    )
 
     # Draw background for service type
-    gz.rectangle(
+    surface.rectangle(
         lx=constants.width/4, ly=Metro.rectangle_height/2 - 30,
         xy=[service_settings.xy[0] + 10, service_settings.xy[1]],
         fill=Tokyu.service_fill
-    ).draw(surface)
+    )
 
 
 def make_vertical_text(text, surface, first_xy, spacing, **kwargs):
     for idx, letter in enumerate(text):
-        gz.text(
+        surface.text(
             letter, xy=[first_xy[0], first_xy[1] + spacing*idx], **kwargs
-        ).draw(surface)
+        )
+
+
+class Sprite(NamedTuple):
+    '''Graphics that were rasterized once, to be drawn many times'''
+    image: object  # From load_image() of the backend
+    # Top left corner, relative to the pixel of the anchor point
+    left: int
+    top: int
+    width: int
+    height: int
+
+
+class SpriteImage(NamedTuple):
+    '''A rasterized sprite, before it is loaded by a backend'''
+    image: np.ndarray  # RGBA
+    left: int
+    top: int
+
+
+# Sprites that were rasterized ahead of time (an Atlas, see atlas.py)
+atlas = None
+
+
+def fraction(xy, scale=1):
+    '''Sub-pixel part of a point, which sprites have to be rasterized at'''
+    return tuple(v * scale - math.floor(v * scale) for v in xy)
+
+
+def crop_image(surface, anchor):
+    '''Crops a transparent surface to what was drawn on it'''
+    image = surface.get_npimage(transparent=True)
+    rows = np.flatnonzero(image[:, :, 3].any(axis=1))
+    cols = np.flatnonzero(image[:, :, 3].any(axis=0))
+    if rows.size == 0:
+        return None
+    image = image[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+    return SpriteImage(image, cols[0] - anchor[0], rows[0] - anchor[1])
+
+
+def sprite_key(make_image, kwargs, backend):
+    '''Identifies the image that make_image(**kwargs) rasterizes with the
+    backend
+    '''
+    # So that scale 1 and 1.0 are the same image
+    kwargs = dict(kwargs, scale=float(kwargs['scale']))
+    return repr(
+        (make_image.__name__, backend.__name__, sorted(kwargs.items()))
+    )
+
+
+def load_sprite(make_image, backend, **kwargs):
+    '''The image of make_image(**kwargs) as a sprite to be drawn on surfaces
+    of the backend, taken from the atlas if it has it
+    '''
+    key = sprite_key(make_image, kwargs, backend)
+    if atlas is not None and key in atlas:
+        sprite = atlas.image(key)
+    else:
+        sprite = make_image(**kwargs, backend=backend)
+    if sprite is None:
+        return None
+    image, left, top = sprite
+    return Sprite(
+        backend.load_image(image), left, top, image.shape[1], image.shape[0]
+    )
+
+
+def blit(surface, sprite, xy):
+    '''Draws a sprite with its anchor at xy, which must have the same
+    fraction as the sprite was rasterized at, in pixels of the surface
+    '''
+    if sprite is None:
+        return
+    # Sprites are in pixels of the surface, not in drawing coordinates
+    scale = surface_scale(surface)
+    x = math.floor(xy[0] * scale) + sprite.left
+    y = math.floor(xy[1] * scale) + sprite.top
+    surface.draw_image(sprite.image, x, y, sprite.width, sprite.height)
+
+
+def vertical_text_image(
+    text, frac_xy, spacing, fontfamily, fontsize, fill, scale=1,
+    backend=GizehSurface
+):
+    '''make_vertical_text() rasterized with the backend (a surface class),
+    anchored at the first letter
+    '''
+    spacing, fontsize = spacing * scale, fontsize * scale
+    margin = math.ceil(fontsize)
+    surface = backend(2 * margin, math.ceil(spacing * len(text)) + 2 * margin)
+    make_vertical_text(
+        text, surface,
+        first_xy=[margin + frac_xy[0], margin + frac_xy[1]],
+        spacing=spacing, fontfamily=fontfamily, fontsize=fontsize, fill=fill
+    )
+    return crop_image(surface, (margin, margin))
+
+
+@lru_cache(maxsize=512)
+def vertical_text_sprite(
+    text, frac_xy, spacing, fontfamily, fontsize, fill, scale=1,
+    backend=GizehSurface
+):
+    '''vertical_text_image() as a sprite'''
+    return load_sprite(
+        vertical_text_image, backend, text=text, frac_xy=frac_xy,
+        spacing=spacing, fontfamily=fontfamily, fontsize=fontsize, fill=fill,
+        scale=scale
+    )
+
+
+def station_number_image(
+    text, frac_xy, fontfamily, fontsize, fill, scale=1, backend=GizehSurface
+):
+    '''A station number rasterized with the backend, anchored at its
+    center
+    '''
+    fontsize *= scale
+    half_height = math.ceil(fontsize)
+    half_width = math.ceil(fontsize * (len(text) + 1) / 2)
+    surface = backend(2 * half_width, 2 * half_height)
+    surface.text(
+        text, fontfamily, fontsize,
+        xy=[half_width + frac_xy[0], half_height + frac_xy[1]], fill=fill
+    )
+    return crop_image(surface, (half_width, half_height))
+
+
+@lru_cache(maxsize=512)
+def station_number_sprite(
+    text, frac_xy, fontfamily, fontsize, fill, scale=1, backend=GizehSurface
+):
+    '''station_number_image() as a sprite'''
+    return load_sprite(
+        station_number_image, backend, text=text, frac_xy=frac_xy,
+        fontfamily=fontfamily, fontsize=fontsize, fill=fill, scale=scale
+    )
+
+
+def transfer_labels_image(
+    translations, frac_xy, row_spacing, fill, scale=1, backend=GizehSurface
+):
+    '''Transfer line names stacked upwards, rasterized with the backend,
+    anchored at the first (bottom) one
+    '''
+    translations = [t._replace(fontsize=t.fontsize * scale) for t in translations]
+    row_spacing *= scale
+    tallest = math.ceil(max(t.fontsize for t in translations))
+    widest = max(t.fontsize * len(t.name) * t.scale_x for t in translations)
+    half_width = math.ceil(widest / 2) + tallest
+    height = math.ceil(row_spacing * (len(translations) - 1)) + 2 * tallest
+    anchor = (half_width, height - tallest)
+
+    surface = backend(2 * half_width, height)
+    for idx, translation in enumerate(translations):
+        x = anchor[0] + frac_xy[0]
+        y = anchor[1] + frac_xy[1] - idx * row_spacing
+        surface.text(
+            translation.name,
+            fontfamily=translation.font,
+            fontsize=translation.fontsize,
+            xy=[x, y],
+            fill=fill,
+            scale_x=translation.scale_x,
+            center=[x, y]
+        )
+    return crop_image(surface, anchor)
+
+
+@lru_cache(maxsize=512)
+def transfer_labels_sprite(
+    translations, frac_xy, row_spacing, fill, scale=1, backend=GizehSurface
+):
+    '''transfer_labels_image() as a sprite'''
+    return load_sprite(
+        transfer_labels_image, backend, translations=translations,
+        frac_xy=frac_xy, row_spacing=row_spacing, fill=fill, scale=scale
+    )
 
 
 def make_bar(surface, constants, bar_width, bar_height, bar_x, bar_y):
     # Light bar
-    gz.rectangle(
+    surface.rectangle(
         lx=bar_width, ly=bar_height,
         xy=[bar_x, bar_y],
         fill=constants.line_color
-    ).draw(surface)
+    )
 
     # Dark bar
     if constants.theme.lower() != 'tokyu':
@@ -122,67 +312,155 @@ def make_bar(surface, constants, bar_width, bar_height, bar_x, bar_y):
     else:
         color = constants.line_color
 
-    gz.rectangle(
+    surface.rectangle(
         lx=bar_width, ly=bar_height,
         xy=[bar_x, bar_y + bar_height],
         fill=color
-    ).draw(surface)
+    )
 
 
 def make_triangles(surface, constants, triangle_x, triangle_width, bar_y,
                    bar_height):
     # Light triangle
-    gz.polyline(
+    surface.polyline(
         [
             (triangle_x                 , bar_y - bar_height/2),
             (triangle_x + triangle_width, bar_y + bar_height/2),
             (triangle_x                 , bar_y + bar_height/2),
         ],
         close_path=True, fill=constants.line_color
-    ).draw(surface)
+    )
 
     # Dark triangle
     if constants.theme.lower() != 'tokyu':
         color = constants.line_color_dark
     else:
         color = constants.line_color
-    gz.polyline(
+    surface.polyline(
         [
             (triangle_x                 , bar_y + bar_height/2),
             (triangle_x + triangle_width, bar_y + bar_height/2),
             (triangle_x                 , bar_y + bar_height*3/2),
         ],
         close_path=True, fill=color
-    ).draw(surface)
+    )
 
 
-def make_station_info(surface, settings_to_show, rect_width, bar_height,
-                      rect_x, spacing, bar_y, section_center, constants):
+def station_color(setting, n, constants):
+    '''Color of the texts of the station in the nth column'''
+    passed = n == 0 and not constants.show_direction
+    return (.5, .5, .5) if setting.skip or passed else (0, 0, 0)
+
+
+def transfer_label(setting, n, layout, constants, language=0, alpha=1):
+    '''The transfer lines of the station in the nth column in a language,
+    as a label like those of station_labels(), or None if it has none
+    '''
+    if not setting.transfers:
+        return None
+    x_pos = layout.rect_x + layout.spacing * n
+    color = station_color(setting, n, constants)
+    if alpha != 1:
+        color = (*color, alpha)
+    adj = 40 if constants.theme.lower() == 'tokyu' else 0
+    return (
+        transfer_labels_image,
+        dict(
+            translations=tuple(
+                transfer[language % len(transfer)]
+                for transfer in setting.transfers
+            ),
+            row_spacing=40, fill=color
+        ),
+        [x_pos, (layout.bar_y - layout.bar_height) + 10 - adj]
+    )
+
+
+def station_labels(setting, n, layout, constants, transfers=True):
+    '''The sprites of the station in the nth column of the line info, as
+    (image function, its arguments except frac_xy and scale, xy). Transfer
+    lines are in their first language, and left out if transfers is False
+    '''
+    x_pos = layout.rect_x + layout.spacing * n
+    color = station_color(setting, n, constants)
+    if constants.theme.lower() == 'tokyu':
+        num_y_pos = (layout.bar_y - layout.bar_height) + 5
+        num_fontsize = 30
+        name_y_pos = layout.section_center - 20
+    else:
+        num_y_pos = layout.section_center - 40
+        num_fontsize = 50
+        name_y_pos = layout.section_center + 40
+
+    labels = [
+        # Station numbers
+        (
+            station_number_image,
+            dict(
+                text=setting.station_number, fontfamily='Roboto',
+                fontsize=num_fontsize, fill=color
+            ),
+            [x_pos, num_y_pos]
+        ),
+    ]
+
+    # Station names
+    # TODO: font, fontsize, change language, option to rotate instead
+    labels.append((
+        vertical_text_image,
+        dict(
+            text=setting.names[0].name, spacing=70,
+            fontfamily='Hiragino Sans GB W3', fontsize=70, fill=color
+        ),
+        [x_pos, name_y_pos]
+    ))
+
+    if transfers and (
+        label := transfer_label(setting, n, layout, constants)
+    ) is not None:
+        labels.append(label)
+    return labels
+
+
+def draw_label(surface, label, origin=(0, 0)):
+    '''Draws a label of station_labels() as a cached sprite, with origin at
+    the top left corner of the surface
+    '''
+    make_image, kwargs, xy = label
+    scale = surface_scale(surface)
+    xy = [xy[0] - origin[0], xy[1] - origin[1]]
+    blit(surface, SPRITES[make_image](
+        **kwargs, frac_xy=fraction(xy, scale), scale=scale,
+        backend=surface_backend(surface)
+    ), xy)
+
+
+SPRITES = {
+    station_number_image: station_number_sprite,
+    vertical_text_image: vertical_text_sprite,
+    transfer_labels_image: transfer_labels_sprite,
+}
+
+
+def make_station_info(
+    surface, settings_to_show, layout, constants, transfers=True
+):
+    bar_y, bar_height = layout.bar_y, layout.bar_height
     if constants.theme.lower() == 'tokyu':
-        func = gz.circle
+        func = surface.circle
         args = {'r': bar_height*0.9}
-        num_y_pos = (bar_y - bar_height) + 5
-        fontsize = 30
-        adj = 40
-        name_y_pos = section_center - 20
     else:
-        func = gz.rectangle
-        args = {'lx': rect_width, 'ly': bar_height*2*0.8}
-        num_y_pos = section_center - 40
-        fontsize = 50
-        adj = 0
-        name_y_pos = section_center + 40
-
-    for n, setting in zip(range(8), settings_to_show):
-        x_pos = rect_x + spacing * n
-        passed = n == 0 and not constants.show_direction
-        color = (.5, .5, .5) if setting.skip or passed else (0, 0, 0)
+        func = surface.rectangle
+        args = {'lx': layout.rect_width, 'ly': bar_height*2*0.8}
+
+    for n, setting in zip(range(MAX_STATIONS), settings_to_show):
+        x_pos = layout.rect_x + layout.spacing * n
         arrow_x_pos = x_pos - 15
         arrow_width = 5
 
         # Station rectangles/circles
         if setting.skip:
-            gz.polyline(
+            surface.polyline(
                 [
                     (arrow_x_pos - arrow_width, bar_y - 5),
                     (arrow_x_pos + arrow_width, bar_y - 5),
@@ -193,60 +471,31 @@ def make_station_info(surface, settings_to_show, rect_width, bar_height,
                 ],
                 stroke=[1,1,1], stroke_width=5,
                 fill=[1,1,1], close_path=True
-            ).draw(surface)
+            )
         else:
             func(
                 fill=[1,1,1,0.9],
                 xy=[x_pos, bar_y + bar_height/2],
                 **args
-            ).draw(surface)
-
-        # Station numbers
-        gz.text(
-            setting.station_number, 'Roboto', fontsize,
-            xy=[x_pos, num_y_pos],
-            fill=color
-        ).draw(surface)
-
-        # Station names
-        # TODO: font, fontsize, change language, option to rotate instead
-        make_vertical_text(
-            setting.names[0].name, surface,
-            first_xy=[x_pos, name_y_pos],
-            spacing=70, fontfamily='Hiragino Sans GB W3', fontsize=70,
-            fill=color
-        )
+            )
 
-        # Display every transfer line for every station in its first language
-        for idx, transfer in enumerate(setting.transfers):
-            line_y_pos = (bar_y - bar_height) + 10 - idx*40 - adj
-            # TODO: Transition between different translations
-            current_translation = transfer[0]
-
-            gz.text(
-                current_translation.name,
-                fontfamily=current_translation.font,
-                fontsize=current_translation.fontsize,
-                xy=[x_pos, line_y_pos],
-                fill=color
-            ).scale(
-                rx=current_translation.scale_x,
-                ry=1,
-                center=[x_pos, line_y_pos]
-            ).draw(surface)
+        # Numbers, names and transfers never change, so they are rasterized
+        # once
+        for label in station_labels(setting, n, layout, constants, transfers):
+            draw_label(surface, label)
 
 
 def make_seperator(surface, constants, section_center):
     if constants.theme.lower() == 'tokyu':
         return
-    gz.polyline(
+    surface.polyline(
         [(0, section_center),(constants.width, section_center)],
         stroke=constants.line_color, stroke_width=8
-    ).draw(surface)
+    )
 
 
 def make_arrow(surface, spacing, rect_width, arrow_x_offset, rect_x, bar_y,
-               bar_height):
+               bar_height, fill=ARROW_FILL):
     arrow_width = spacing / 2 - rect_width/2
     points = [
         (
@@ -274,19 +523,27 @@ def make_arrow(surface, spacing, rect_width, arrow_x_offset, rect_x, bar_y,
             bar_y + bar_height/2
         ),
     ]
-    gz.polyline(
-        points,close_path=True, stroke=[1,1,1], stroke_width=5,
-        fill=rgb([251, 3, 1])
-    ).draw(surface)
-    # TODO flash arrow color
+    surface.polyline(
+        points,close_path=True, stroke=[1,1,1], stroke_width=5, fill=fill
+    )
+
+
+class LineLayout(NamedTuple):
+    '''Where the parts of the line info are'''
+    section_center: float
+    bar_height: float
+    bar_width: float
+    bar_x: float
+    bar_y: float
+    triangle_width: float
+    triangle_x: float
+    rect_width: float
+    rect_x: float
+    spacing: float
 
 
-def make_line_info(surface, constants, settings, station_idx):
-    # Set values
+def line_layout(constants):
     # Fundamental constants
-    max_stations = 8
-    number_of_stations = len(settings)
-    remaining_stations = number_of_stations - station_idx
     section_center = (
         (constants.height - constants.sep_height) / 2
         + constants.sep_height
@@ -316,49 +573,212 @@ def make_line_info(surface, constants, settings, station_idx):
         + edge_padding
     )
     max_rect_x = triangle_x - edge_padding - rect_width/2
-    spacing = (max_rect_x - rect_x) / (max_stations - 1)
+    spacing = (max_rect_x - rect_x) / (MAX_STATIONS - 1)
+
+    return LineLayout(
+        section_center, bar_height, bar_width, bar_x, bar_y, triangle_width,
+        triangle_x, rect_width, rect_x, spacing
+    )
+
+
+class ArrowLayer(NamedTuple):
+    '''The arrow of the line info as a function of time, moving from the
+    previous station that is not skipped to the current one and flashing.
+    Offsets are from the first rectangle, in multiples of the spacing
+    '''
+    layout: LineLayout
+    start: float
+    end: float
+    flash: bool
+
+
+def arrow_layer(constants, settings, station_idx, moves=True):
+    '''The ArrowLayer of the station, or None if its arrow does not move or
+    flash and is drawn with the rest of the line info. If moves is False,
+    the arrow stays at the station, as in every segment of the station but
+    the first
+    '''
+    _, arrow_position = station_window(
+        settings, station_idx, MAX_STATIONS, constants.loop
+    )
+    start = arrow_position
+    if moves and constants.animate_arrow and (
+        station_idx > 0 or constants.loop
+    ):
+        skipped = find_prev_unskipped_station(
+            station_idx, settings, constants.loop
+        ) - 1
+        if skipped:
+            start = max(arrow_position - skipped, 0)
+    if start == arrow_position and not constants.flash_arrow:
+        return None
+    return ArrowLayer(
+        line_layout(constants), start, arrow_position, constants.flash_arrow
+    )
+
+
+def arrow_box(layer):
+    '''(left, top, right, bottom) of everything that the layer draws'''
+    layout = layer.layout
+    margin = 3  # Half of the stroke, rounded up
+    left = layout.rect_x + layout.rect_width/2 + layout.spacing * min(
+        layer.start, layer.end
+    )
+    right = layout.rect_x - layout.rect_width/2 + layout.spacing * (
+        max(layer.start, layer.end) + 1
+    )
+    return (
+        left - margin, layout.bar_y - layout.bar_height/2 - margin,
+        right + margin, layout.bar_y + layout.bar_height*3/2 + margin
+    )
+
+
+def draw_arrow_layer(surface, layer, t, duration, origin=(0, 0)):
+    '''Draws the arrow at time t, with origin at the top left corner of the
+    surface
+    '''
+    progress = t / duration
+    offset = layer.start + (layer.end - layer.start) * progress
+    fill = ARROW_FILL
+    if layer.flash:
+        # Lightest halfway, so that the freezes show the usual color
+        light = ARROW_FLASH * (1 - abs(2 * progress - 1))
+        fill = [c + (1 - c) * light for c in fill]
+    layout = layer.layout
+    make_arrow(
+        surface, layout.spacing, layout.rect_width, layout.spacing * offset,
+        layout.rect_x - origin[0], layout.bar_y - origin[1],
+        layout.bar_height, fill
+    )
+
+
+class TransferLayer(NamedTuple):
+    '''The transfer labels of the line info as a function of time, fading
+    from one language to the next together with the station name
+    '''
+    layout: LineLayout
+    constants: Constants
+    columns: tuple  # (station settings, column) of stations with transfers
+    old: int  # Index of the language
+    new: int
+
+
+def transfer_layer(constants, settings, station_idx, language):
+    '''The TransferLayer of the transition from the language of the station
+    name to the next one, or None if the transfer labels do not change and
+    are drawn with the rest of the line info
+    '''
+    if not constants.animate_transfers:
+        return None
+    settings_to_show, _ = station_window(
+        settings, station_idx, MAX_STATIONS, constants.loop
+    )
+    new = (language + 1) % len(settings[station_idx].names)
+    columns = tuple(
+        (setting, n)
+        for n, setting in zip(range(MAX_STATIONS), settings_to_show)
+        if setting.transfers
+    )
+    if all(
+        transfer[language % len(transfer)] == transfer[new % len(transfer)]
+        for setting, _ in columns for transfer in setting.transfers
+    ):
+        return None
+    return TransferLayer(
+        line_layout(constants), constants, columns, language, new
+    )
+
+
+def transfer_labels(layer, old_alpha, new_alpha):
+    '''The labels of the layer at these alphas, rounded to FADE_STEPS so
+    that there are few sprites to rasterize
+    '''
+    old_alpha = round(old_alpha * FADE_STEPS) / FADE_STEPS
+    new_alpha = round(new_alpha * FADE_STEPS) / FADE_STEPS
+    labels = []
+    for setting, n in layer.columns:
+        def label(language, alpha=1):
+            return transfer_label(
+                setting, n, layer.layout, layer.constants, language, alpha
+            )
+        if label(layer.old) == label(layer.new):
+            # Does not change language, so it does not fade either
+            labels.append(label(layer.old))
+            continue
+        if old_alpha > 0:
+            labels.append(label(layer.old, old_alpha))
+        if new_alpha > 0:
+            labels.append(label(layer.new, new_alpha))
+    return labels
+
+
+def transfer_box(layer, backend):
+    '''(left, top, right, bottom) of everything that the layer draws with
+    the backend at scale 1, or None if it draws nothing
+    '''
+    boxes = []
+    for make_image, kwargs, xy in transfer_labels(layer, 1, 1):
+        sprite = SPRITES[make_image](
+            **kwargs, frac_xy=fraction(xy), backend=backend
+        )
+        if sprite is None:
+            continue
+        left = math.floor(xy[0]) + sprite.left
+        top = math.floor(xy[1]) + sprite.top
+        boxes.append((left, top, left + sprite.width, top + sprite.height))
+    if not boxes:
+        return None
+    return (
+        min(box[0] for box in boxes), min(box[1] for box in boxes),
+        max(box[2] for box in boxes), max(box[3] for box in boxes)
+    )
+
+
+def draw_transfer_layer(surface, layer, old_alpha, new_alpha, origin=(0, 0)):
+    '''Draws the transfer labels, with origin (in whole pixels) at the top
+    left corner of the surface
+    '''
+    for label in transfer_labels(layer, old_alpha, new_alpha):
+        draw_label(surface, label, origin)
+
+
+def make_line_info(
+    surface, constants, settings, station_idx, arrow=True, transfers=True
+):
+    '''Draws the line info of the station, without the arrow or the
+    transfer labels if they are False (when they are drawn as layers)
+    '''
+    layout = line_layout(constants)
 
     # Arrow and station slice settings
-    arrow_x_offset = 0
-
-    if remaining_stations <= max_stations - 2:
-        # End of the line: show all 8 stations from the last
-        settings_to_show = settings[-max_stations:]
-        # Move arrow to between next rectangle
-        arrow_x_offset = spacing * (max_stations - 1 - remaining_stations)
-    elif station_idx == 0:
-        # 1st -> 2nd station: show 1st station as 'previous'
-        settings_to_show = settings[station_idx:station_idx + max_stations]
-        # Move arrow to center of first rectangle
-        arrow_x_offset = - spacing/2
-    else:
-        # Anywhere else in the line: show the previous station that isn't skipped
-        i = find_prev_unskipped_station(station_idx, settings)
-        settings_to_show = settings[station_idx - i : station_idx + max_stations - 1]
-        # Move arrow to between previous and next station rectangle
-        # TODO: add config to disable this
-        arrow_x_offset = spacing * (i - 1)
-        # TODO: even better, animate the arrow moving in-between skipped stations
+    settings_to_show, arrow_position = station_window(
+        settings, station_idx, MAX_STATIONS, constants.loop
+    )
+    arrow_x_offset = layout.spacing * arrow_position
 
     # Actually draw the frame
-    make_bar(surface, constants, bar_width, bar_height, bar_x, bar_y)
+    make_bar(
+        surface, constants, layout.bar_width, layout.bar_height, layout.bar_x,
+        layout.bar_y
+    )
 
-    if remaining_stations > max_stations - 1:
+    if line_continues(settings, station_idx, constants.loop, MAX_STATIONS):
         make_triangles(
-            surface, constants, triangle_x, triangle_width, bar_y,
-            bar_height
+            surface, constants, layout.triangle_x, layout.triangle_width,
+            layout.bar_y, layout.bar_height
         )
 
     make_station_info(
-        surface, settings_to_show, rect_width, bar_height, rect_x,
-        spacing, bar_y, section_center, constants
+        surface, settings_to_show, layout, constants, transfers
     )
 
-    make_seperator(surface, constants, section_center)
+    make_seperator(surface, constants, layout.section_center)
 
-    make_arrow(
-        surface, spacing, rect_width, arrow_x_offset, rect_x, bar_y, bar_height
-    )
+    if arrow:
+        make_arrow(
+            surface, layout.spacing, layout.rect_width, arrow_x_offset,
+            layout.rect_x, layout.bar_y, layout.bar_height
+        )
 
 
 def make_station_icon(surface, settings, n, constants, text=None):
@@ -379,36 +799,36 @@ def make_station_icon(surface, settings, n, constants, text=None):
 
     if constants.icon_shape.lower() == 'square':
         mod = 40
-        gz.square(
+        surface.square(
             constants.icon_size,
             xy=[x_pos, y_pos],
             stroke=stroke,
             stroke_width=stroke_width,
             fill=fill
-        ).draw(surface)
+        )
     else:
         mod = 45
-        gz.circle(
+        surface.circle(
             constants.icon_size,
             xy=[x_pos, y_pos],
             stroke=constants.line_color,
             stroke_width=30,
             fill=[1,1,1]
-        ).draw(surface)
+        )
 
     if text:
         line, num = text.split('-')
     else:
         line, num = settings[n].station_number.split('-')
-    gz.text(
+    surface.text(
         line, constants.icon_text_font,
         constants.icon_line_fontsize + letter_mod,
         xy=[x_pos, y_pos-mod],
         fill=text_fill
-    ).draw(surface)
-    gz.text(
+    )
+    surface.text(
         num, constants.icon_text_font,
         constants.icon_station_fontsize - letter_mod,
         xy=[x_pos, y_pos+30],
         fill=text_fill
-    ).draw(surface)
+    )
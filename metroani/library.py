@@ -0,0 +1,134 @@
+'''Exporting every train state of every station as its own file, for players
+that pick what to show based on the position of the train
+'''
+import json
+import math
+import os
+from itertools import groupby
+
+import moviepy.editor as mpy
+
+from .animate import animate_segment
+from .timeline import make_timeline, segment_key, settings_hash
+
+__all__ = ['write_library']
+
+
+def keyframe_params(fps, keyframe_interval):
+    '''ffmpeg options that put keyframes at the same times in every file'''
+    return [
+        '-force_key_frames', f'expr:gte(t,n_forced*{keyframe_interval})',
+        '-g', str(max(1, round(fps * keyframe_interval))),
+    ]
+
+
+def load_entries(manifest_file):
+    '''Previously written files and their entries, by filename'''
+    try:
+        with open(manifest_file, 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return {entry['file']: entry for entry in manifest['segments']}
+
+
+def write_playlist(path, entries):
+    '''HLS-style playlist of the files in timeline order'''
+    target = math.ceil(max((entry['duration'] for entry in entries), default=0))
+    lines = [
+        '#EXTM3U',
+        '#EXT-X-VERSION:3',
+        f'#EXT-X-TARGETDURATION:{target}',
+        '#EXT-X-MEDIA-SEQUENCE:0',
+        '#EXT-X-PLAYLIST-TYPE:VOD',
+    ]
+    for entry in entries:
+        lines.append('#EXT-X-DISCONTINUITY')
+        lines.append(f"#EXTINF:{entry['duration']:.3f},")
+        lines.append(entry['file'])
+    lines.append('#EXT-X-ENDLIST')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_library(
+    directory, constants, station_settings, terminal_settings, state_settings,
+    service_settings, fps, ext='mp4', codec=None, keyframe_interval=1,
+    **write_kwargs
+):
+    '''Writes every train state of every station into its own file, with
+    keyframes at the same times in every file, and a manifest.json that maps
+    station index and state index to the file
+
+    Files that were already written with the same content are kept.
+    Extra keyword arguments are passed to VideoClip.write_videofile()
+    '''
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline = make_timeline(
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+    encoding = settings_hash(fps, ext, codec, keyframe_interval, write_kwargs)
+    manifest_file = os.path.join(directory, 'manifest.json')
+    os.makedirs(directory, exist_ok=True)
+    previous = load_entries(manifest_file)
+
+    ffmpeg_params = (
+        keyframe_params(fps, keyframe_interval)
+        + write_kwargs.pop('ffmpeg_params', [])
+    )
+
+    entries = []
+    for (n, state), group in groupby(timeline, lambda s: (s.n, s.state)):
+        segments = list(group)
+        key = settings_hash(encoding, [
+            segment_key(
+                segment, constants, station_settings, terminal_settings,
+                service_settings
+            )
+            for segment in segments
+        ])
+        filename = f'{n:04d}_{station_settings[n].station_number}_{state}.{ext}'
+        entry = {
+            'station': n,
+            'station_number': station_settings[n].station_number,
+            'state': state,
+            'file': filename,
+            'start': segments[0].start,
+            'duration': sum(segment.duration for segment in segments),
+            'key': key,
+        }
+        entries.append(entry)
+
+        path = os.path.join(directory, filename)
+        # Only reuse the file if it was written with the same content
+        if (
+            filename in previous and previous[filename]['key'] == key
+            and os.path.exists(path)
+        ):
+            continue
+
+        clip = mpy.concatenate_videoclips([
+            animate_segment(segment, *settings) for segment in segments
+        ])
+        root, _ = os.path.splitext(path)
+        tmp = f'{root}.partial.{ext}'
+        clip.write_videofile(
+            tmp, fps=fps, codec=codec, audio=False,
+            ffmpeg_params=ffmpeg_params, **write_kwargs
+        )
+        clip.close()
+        os.replace(tmp, path)
+
+    # index[station][state] is the position of the file in segments
+    index = {}
+    for position, entry in enumerate(entries):
+        index.setdefault(str(entry['station']), {})[str(entry['state'])] = position
+
+    with open(manifest_file, 'w') as f:
+        json.dump(
+            {'fps': fps, 'segments': entries, 'index': index}, f, indent=4
+        )
+    write_playlist(os.path.join(directory, 'playlist.m3u8'), entries)
+
+    return entries
@@ -0,0 +1,343 @@
+'''Rendering frames in real time for a live display, driven by train events
+
+Events are lines of text, from stdin or a local socket:
+
+    approaching 5   the train is approaching station 5
+    arrived         the train arrived at the current station
+    departed        the train departed, the next station is shown
+
+Run with, for example:
+
+    python -m metroani.live settings/full.json --fps 30 < events.txt \\
+        | ffplay -f rawvideo -pixel_format rgb24 -video_size 1920x1080 \\
+          -framerate 30 -
+'''
+from __future__ import annotations
+import argparse
+import math
+import queue
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from itertools import groupby
+from typing import NamedTuple, Optional
+
+from .ft import compile_plan, draw_plan
+from .timeline import make_timeline, segment_key
+
+__all__ = ['LiveRenderer', 'stream_events', 'socket_events']
+
+# Train states are in the same order as in the settings (next, arriving,
+# currently), so every event selects the state at its index. Settings with
+# fewer states have no state for the last events
+EVENTS = ('departed', 'approaching', 'arrived')
+
+
+class Event(NamedTuple):
+    kind: str  # Any of EVENTS
+    n: Optional[int]  # Station index, if given
+
+
+def parse_event(line):
+    words = line.split()
+    if not words or words[0] not in EVENTS:
+        if words:
+            print(f'Ignoring unknown event: {line.strip()}', file=sys.stderr)
+        return None
+    try:
+        n = int(words[1]) if len(words) > 1 else None
+    except ValueError:
+        print(
+            f'Ignoring event with a bad station: {line.strip()}',
+            file=sys.stderr
+        )
+        return None
+    return Event(words[0], n)
+
+
+def stream_events(stream):
+    '''Events from a text stream such as sys.stdin, one per line'''
+    for line in stream:
+        if (event := parse_event(line)):
+            yield event
+
+
+def socket_events(port, host='127.0.0.1'):
+    '''Events from every connection to a local TCP socket, one per line'''
+    with socket.create_server((host, port)) as server:
+        while True:
+            connection, _ = server.accept()
+            with connection, connection.makefile('r') as stream:
+                yield from stream_events(stream)
+
+
+class LRUCache:
+    '''Least-recently-used cache of rendered frames or compiled transitions,
+    shared with the warm up thread
+    '''
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, count=True):
+        with self.lock:
+            item = self.items.get(key)
+            if item is not None:
+                self.items.move_to_end(key)
+            if count:
+                if item is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            return item
+
+    def put(self, key, item):
+        with self.lock:
+            self.items[key] = item
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+
+class LiveStats:
+    def __init__(self):
+        self.shown = 0
+        self.dropped = 0
+        self.total_latency = 0
+        self.max_latency = 0
+
+    def record(self, latency):
+        self.shown += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+
+    def __str__(self):
+        mean = self.total_latency / self.shown if self.shown else 0
+        total = self.shown + self.dropped
+        percent = 100 * self.dropped / total if total else 0
+        return (
+            f'{self.shown} frames shown, {self.dropped} dropped '
+            f'({percent:.1f}%); latency mean {mean * 1000:.1f}ms, '
+            f'max {self.max_latency * 1000:.1f}ms'
+        )
+
+
+class LiveRenderer:
+    '''Renders the current train state of the current station in a loop, at
+    the refresh rate of the display
+    '''
+    def __init__(
+        self, constants, station_settings, terminal_settings, state_settings,
+        service_settings, fps, cache_frames=128
+    ):
+        self.constants = constants
+        self.station_settings = station_settings
+        self.terminal_settings = terminal_settings
+        self.service_settings = service_settings
+        self.fps = fps
+        self.cache = LRUCache(cache_frames)
+        self.stats = LiveStats()
+
+        timeline = make_timeline(
+            constants, station_settings, terminal_settings, state_settings,
+            service_settings
+        )
+        # Every train state of every station is looped on its own
+        self.loops = {
+            key: list(group)
+            for key, group in groupby(timeline, lambda s: (s.n, s.state))
+        }
+        # Compiled transitions, by segment index, of the current loop and
+        # the one being warmed up
+        self.plans = LRUCache(2 * max(map(len, self.loops.values())))
+        self.event_states = dict(zip(EVENTS, range(len(state_settings))))
+        self.keys = {
+            segment.index: segment_key(
+                segment, constants, station_settings, terminal_settings,
+                service_settings
+            )
+            for segment in timeline
+        }
+        self.n, self.state = next(iter(self.loops))
+        self.loop_start = time.perf_counter()
+
+        self.warm_queue = queue.Queue()
+        threading.Thread(target=self.warm_worker, daemon=True).start()
+        self.warm(self.next_loop())
+
+    def next_station(self, n):
+        if self.constants.loop:
+            # The first station follows the last
+            first = next(iter(self.loops))[0]
+        else:
+            first = n
+        return next((m for m, _ in self.loops if m > n), first)
+
+    def next_loop(self):
+        '''The loop that the next expected event will select'''
+        state = self.state + 1
+        if (self.n, state) in self.loops:
+            return (self.n, state)
+        return (self.next_station(self.n), 0)
+
+    def handle(self, event):
+        if event.kind == 'departed':
+            n = event.n if event.n is not None else self.next_station(self.n)
+        else:
+            n = event.n if event.n is not None else self.n
+        if event.kind not in self.event_states:
+            print(
+                f'The settings have no state for {event.kind}, ignoring '
+                f'{event}',
+                file=sys.stderr
+            )
+            return
+        if (n, self.event_states[event.kind]) not in self.loops:
+            print(f'Station {n} is not shown, ignoring {event}', file=sys.stderr)
+            return
+        self.n = n
+        self.state = self.event_states[event.kind]
+        self.loop_start = time.perf_counter()
+        self.warm(self.next_loop())
+
+    def source_frame(self, segment, t):
+        '''Index of the transition frame shown at time t of the segment'''
+        constants = self.constants
+        if segment.freeze_start:
+            t -= constants.freeze_duration
+        if t <= 0:
+            return 0
+        last = math.ceil(constants.duration * self.fps)
+        return min(int(t * self.fps), last)
+
+    def plan(self, segment):
+        if (plan := self.plans.get(segment.index, count=False)) is None:
+            plan = compile_plan(
+                constants=self.constants, n=segment.n,
+                settings=self.station_settings,
+                next_settings=segment.next_settings,
+                terminal_settings=self.terminal_settings,
+                old=segment.old, new=segment.new,
+                old_next=segment.old_next, new_next=segment.new_next,
+                old_term=segment.old_term, new_term=segment.new_term,
+                service_settings=self.service_settings,
+                old_service=segment.old_service,
+                new_service=segment.new_service,
+                arrow_moves=segment.arrow_moves
+            )
+            self.plans.put(segment.index, plan)
+        return plan
+
+    def render(self, segment, idx):
+        key = (self.keys[segment.index], idx)
+        if (frame := self.cache.get(key)) is not None:
+            return frame
+        t = min(idx / self.fps, self.constants.duration)
+        frame = draw_plan(self.plan(segment), t)
+        self.cache.put(key, frame)
+        return frame
+
+    def frame(self, now):
+        '''The frame to show at time now'''
+        segments = self.loops[(self.n, self.state)]
+        duration = sum(segment.duration for segment in segments)
+        t = (now - self.loop_start) % duration
+        for segment in segments:
+            if t < segment.duration:
+                break
+            t -= segment.duration
+        return self.render(segment, self.source_frame(segment, t))
+
+    def warm(self, loop):
+        self.warm_queue.put(loop)
+
+    def warm_worker(self):
+        '''Renders the first segment of a loop before it is needed; the rest
+        can be rendered while its first frame is frozen
+        '''
+        while True:
+            loop = self.warm_queue.get()
+            segment = self.loops[loop][0]
+            key = self.keys[segment.index]
+            last = math.ceil(self.constants.duration * self.fps)
+            for idx in range(last + 1):
+                if not self.warm_queue.empty():
+                    break  # A newer event made this loop outdated
+                if self.cache.get((key, idx), count=False) is None:
+                    self.render(segment, idx)
+
+    def run(self, display, events=(), duration=None):
+        '''Shows a frame on the display every 1/fps seconds until duration
+        seconds have passed (or forever), handling events as they come.
+        Frames that cannot be rendered in time are dropped
+        '''
+        pending = queue.Queue()
+
+        def read_events():
+            for event in events:
+                pending.put(event)
+        threading.Thread(target=read_events, daemon=True).start()
+
+        period = 1 / self.fps
+        start = next_tick = time.perf_counter()
+        while duration is None or next_tick - start < duration:
+            while not pending.empty():
+                self.handle(pending.get())
+
+            before = time.perf_counter()
+            display(self.frame(next_tick))
+            self.stats.record(time.perf_counter() - before)
+
+            next_tick += period
+            now = time.perf_counter()
+            if now > next_tick:
+                # Skip the frames whose time has already passed
+                missed = math.floor((now - next_tick) / period) + 1
+                self.stats.dropped += missed
+                next_tick += missed * period
+            time.sleep(max(0, next_tick - time.perf_counter()))
+        return self.stats
+
+
+def main():
+    from .metroani import settings_from_json
+
+    parser = argparse.ArgumentParser(
+        description='Writes raw rgb24 frames to stdout in real time'
+    )
+    parser.add_argument('settings', help='JSON settings file')
+    parser.add_argument('--fps', type=float, default=60)
+    parser.add_argument('--duration', type=float, default=None)
+    parser.add_argument(
+        '--port', type=int, default=None,
+        help='Read events from this local TCP port instead of stdin'
+    )
+    args = parser.parse_args()
+
+    renderer = LiveRenderer(*settings_from_json(args.settings), fps=args.fps)
+    if args.port is None:
+        events = stream_events(sys.stdin)
+    else:
+        events = socket_events(args.port)
+
+    def display(frame):
+        sys.stdout.buffer.write(frame.tobytes())
+
+    try:
+        renderer.run(display, events, args.duration)
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    print(renderer.stats, file=sys.stderr)
+    print(
+        f'cache: {renderer.cache.hits} hits, {renderer.cache.misses} misses',
+        file=sys.stderr
+    )
+
+
+if __name__ == '__main__':
+    main()
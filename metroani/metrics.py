@@ -0,0 +1,229 @@
+'''Counters, gauges and latency histograms of a render, for monitoring'''
+import bisect
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+__all__ = ['Metrics']
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, math.inf)
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            total += count
+            yield bound, total
+
+
+def escape(value):
+    '''Label value escaped like the Prometheus text format requires'''
+    return (
+        str(value).replace('\\', '\\\\').replace('"', '\\"')
+        .replace('\n', '\\n')
+    )
+
+
+def label_text(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{k}="{escape(v)}"' for k, v in items) + '}'
+
+
+def family_lines(metrics, metric_type, samples, suffix=''):
+    '''Lines of every metric sorted by name and labels, with a TYPE line
+    before the metrics of each name. samples(name, labels, value) returns
+    the sample lines of a metric
+    '''
+    previous = None
+    for (name, labels), value in sorted(metrics.items()):
+        if name != previous:
+            yield f'# TYPE metroani_{name}{suffix} {metric_type}'
+            previous = name
+        yield from samples(name, labels, value)
+
+
+def histogram_samples(name, labels, histogram):
+    for bound, count in histogram.cumulative():
+        le = '+Inf' if bound == math.inf else bound
+        yield f'metroani_{name}_bucket{label_text(labels, le=le)} {count}'
+    yield f'metroani_{name}_count{label_text(labels)} {histogram.count}'
+    yield f'metroani_{name}_sum{label_text(labels)} {histogram.sum}'
+
+
+class Metrics:
+    '''Metrics of a render, passed as the metrics of stream_video() or
+    write_sinks()
+
+    Counts frames rendered and encoded (per sink), render and encode latency
+    histograms, encoder queue depths (per sink), and hits and misses of the
+    caches. If callback is given, it is called with the Metrics at most every
+    interval seconds, for example to dump them to a file:
+    >>> Metrics(callback=lambda m: m.write('render.prom'), interval=10)
+    '''
+    def __init__(self, callback=None, interval=1.0):
+        self.callback = callback
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.last_callback = self.start
+        # Only one thread calls the callback at a time
+        self.callback_lock = threading.Lock()
+        # Keyed by (name, labels), where labels is a tuple of (key, value)
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.caches = {}
+
+    def count(self, name, n=1, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + n
+        self.tick()
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, tuple(labels.items()))] = value
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(labels.items()))
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = Histogram()
+            self.histograms[key].observe(seconds)
+        self.tick()
+
+    def watch_cache(self, name, stats):
+        '''stats() returns the (hits, misses) of the cache, read when the
+        metrics are exported
+        '''
+        self.caches[name] = stats
+
+    def tick(self):
+        '''Calls the callback if it is due. Errors of the callback are
+        reported instead of raised, so they never fail the render
+        '''
+        if self.callback is None:
+            return
+        # Other threads go on instead of waiting for the callback
+        if not self.callback_lock.acquire(blocking=False):
+            return
+        try:
+            now = time.perf_counter()
+            if now - self.last_callback >= self.interval:
+                self.last_callback = now
+                self.callback(self)
+        except Exception as e:
+            print(f'Metrics callback failed: {e!r}', file=sys.stderr)
+        finally:
+            self.callback_lock.release()
+
+    def cache_counters(self):
+        counters = {}
+        for name, stats in self.caches.items():
+            hits, misses = stats()
+            counters[('cache_hits', (('cache', name),))] = hits
+            counters[('cache_misses', (('cache', name),))] = misses
+        return counters
+
+    def snapshot(self):
+        '''All metrics as a JSON-serializable dict'''
+        with self.lock:
+            counters = {**self.counters, **self.cache_counters()}
+            return {
+                'elapsed': time.perf_counter() - self.start,
+                'counters': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in counters.items()
+                ],
+                'gauges': [
+                    {'name': name, 'labels': dict(labels), 'value': value}
+                    for (name, labels), value in self.gauges.items()
+                ],
+                'histograms': [
+                    {
+                        'name': name, 'labels': dict(labels),
+                        'count': histogram.count, 'sum': histogram.sum,
+                        'buckets': [
+                            [str(bound), count]
+                            for bound, count in histogram.cumulative()
+                        ],
+                    }
+                    for (name, labels), histogram in self.histograms.items()
+                ],
+            }
+
+    def prometheus(self):
+        '''All metrics in the Prometheus text exposition format'''
+        lines = []
+        with self.lock:
+            counters = {**self.counters, **self.cache_counters()}
+            lines += [
+                '# TYPE metroani_elapsed_seconds gauge',
+                f'metroani_elapsed_seconds {time.perf_counter() - self.start}',
+            ]
+            lines += family_lines(
+                counters, 'counter',
+                lambda name, labels, value: [
+                    f'metroani_{name}_total{label_text(labels)} {value}'
+                ],
+                suffix='_total'
+            )
+            lines += family_lines(
+                self.gauges, 'gauge',
+                lambda name, labels, value: [
+                    f'metroani_{name}{label_text(labels)} {value}'
+                ]
+            )
+            lines += family_lines(
+                self.histograms, 'histogram', histogram_samples
+            )
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        '''Writes the metrics to a file, as JSON if the path ends with .json
+        and in the Prometheus text format otherwise
+        '''
+        if path.endswith('.json'):
+            text = json.dumps(self.snapshot(), indent=4)
+        else:
+            text = self.prometheus()
+        # Write-then-rename so that readers never see a half-written file,
+        # to a name of its own in case several threads or processes write
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'w') as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+
+def timed_frames(frames, metrics):
+    '''Passes the frames on while recording how long each took to render'''
+    if metrics is None:
+        yield from frames
+        return
+    frames = iter(frames)
+    while True:
+        start = time.perf_counter()
+        try:
+            frame = next(frames)
+        except StopIteration:
+            return
+        metrics.observe('render_seconds', time.perf_counter() - start)
+        metrics.count('frames_rendered')
+        yield frame
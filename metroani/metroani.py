@@ -2,39 +2,49 @@ import json
 
 import moviepy.editor as mpy
 
-from .animate import combine_train_states
+from .animate import animate_segment
+from .compiled import cached_settings
+from .fit import fit_settings
 from .s_types import Constants, Transition, StationTransition, TerminusTransition
+from .timeline import make_timeline
 
 
 def make_video(
     constants, station_settings, terminal_settings, state_settings, service_settings
 ):
-    start = 0 if constants.show_direction else 1
-    final = (
-        combine_train_states(
-            n, station_settings, state_settings, terminal_settings, constants,
-            service_settings
-        )
-        for n in range(start, len(station_settings))
+    timeline = make_timeline(
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
     )
 
     return mpy.concatenate_videoclips([
-        clip
-        for station_clips in final
-        for clip in station_clips
-        if clip is not None
+        animate_segment(
+            segment, station_settings, terminal_settings, constants,
+            service_settings
+        )
+        for segment in timeline
     ])
 
 
-def settings_from_json(file_):
-    with open(file_, 'r') as f:
-        settings = json.load(f)
-
-    return (
-        Constants(**settings['constants']),
-        StationTransition.from_json_list(settings, 'stations'),
-        TerminusTransition.from_json(settings, 'terminal'),
-        [Transition.from_json(settings['states'], key)
-         for key in settings['states'].keys()],
-        Transition.from_json(settings, 'service_type')
-    )
+def settings_from_json(file_, fit=False):
+    '''Settings from a json file. If fit, the scale_x, enter_xy and exit_xy
+    of the texts are computed by fit_settings instead of read from the file.
+    If the file was compiled with compile_settings() since it last changed,
+    the compiled settings are loaded instead
+    '''
+    with open(file_, 'rb') as f:
+        source = f.read()
+
+    if (settings := cached_settings(file_, source)) is None:
+        settings = json.loads(source)
+        settings = (
+            Constants(**settings['constants']),
+            StationTransition.from_json_list(settings, 'stations'),
+            TerminusTransition.from_json(settings, 'terminal'),
+            [Transition.from_json(settings['states'], key)
+             for key in settings['states'].keys()],
+            Transition.from_json(settings, 'service_type')
+        )
+    if fit:
+        return fit_settings(*settings)
+    return settings
@@ -0,0 +1,84 @@
+'''Transparent overlays of the animated parts of a video, for compositing
+over other backgrounds
+
+Only the texts, the line info and the station icon are drawn on every frame,
+onto a transparent background. The background of the theme is the same in
+every frame, so it is written once as a still; the overlay composited over
+the still is the same as the video.
+'''
+import math
+import os
+
+import proglog
+from PIL import Image
+
+from .ft import draw_still
+from .render import stream_frames
+from .sequence import write_sequence
+from .sinks import Sink, encode_frames
+from .timeline import iter_timeline
+
+__all__ = ['write_still', 'write_overlay']
+
+# Codecs with alpha, and the options that keep it, by extension
+ALPHA_CODECS = {
+    '.mov': ('prores_ks', ['-profile:v', '4444', '-pix_fmt', 'yuva444p10le']),
+    '.webm': (
+        'libvpx-vp9', ['-pix_fmt', 'yuva420p', '-auto-alt-ref', '0']
+    ),
+}
+
+
+def write_still(filename, constants, service_settings, scale=1):
+    '''Writes the background of the video to an image file'''
+    Image.fromarray(draw_still(constants, service_settings, scale)).save(
+        filename
+    )
+
+
+def write_overlay(
+    output, constants, station_settings, terminal_settings, state_settings,
+    service_settings, fps, still=None, queue_size=16, threads=None,
+    logger='bar', **sequence_kwargs
+):
+    '''Renders the video without its background, as RGBA frames with a
+    transparent background, and writes the background to still if given
+
+    output is a .mov (ProRes 4444), a .webm (VP9 with alpha) or a directory,
+    which gets a PNG sequence like write_sequence(), with sequence_kwargs
+    '''
+    if still is not None:
+        write_still(still, constants, service_settings)
+
+    ext = os.path.splitext(output)[1].lower()
+    if not ext:
+        return write_sequence(
+            output, constants, station_settings, terminal_settings,
+            state_settings, service_settings, fps, logger=logger,
+            overlay=True, **sequence_kwargs
+        )
+    if ext not in ALPHA_CODECS:
+        raise ValueError(
+            f'No codec with alpha for {output}, expected a directory or one '
+            f'of {", ".join(ALPHA_CODECS)}'
+        )
+
+    codec, ffmpeg_params = ALPHA_CODECS[ext]
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline_settings = (
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+    duration = sum(
+        segment.duration for segment in iter_timeline(*timeline_settings)
+    )
+    frames = stream_frames(
+        iter_timeline(*timeline_settings), settings, fps, overlay=True
+    )
+    logger = proglog.default_bar_logger(logger)
+    bar = logger.iter_bar(frame_index=range(math.ceil(duration * fps)))
+    encode_frames(
+        (frame for _, frame in zip(bar, frames)),
+        [Sink(output, codec, ffmpeg_params=ffmpeg_params, alpha=True)],
+        (constants.width, constants.height), fps, queue_size, threads
+    )
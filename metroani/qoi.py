@@ -0,0 +1,122 @@
+'''Vectorized encoder of the QOI image format (https://qoiformat.org)
+
+The reference encoder goes pixel by pixel, but every QOI operation only
+depends on the previous pixel and the previous pixel with the same hash, so
+the whole image can be encoded at once with numpy
+'''
+import struct
+
+import numpy as np
+
+__all__ = ['encode_qoi', 'write_qoi']
+
+OP_INDEX = 0x00
+OP_DIFF = 0x40
+OP_LUMA = 0x80
+OP_RUN = 0xc0
+OP_RGB = 0xfe
+MAX_RUN = 62
+PADDING = bytes((0, 0, 0, 0, 0, 0, 0, 1))
+
+
+def wrap(x):
+    '''Difference of two channels, wrapped around like uint8 arithmetic'''
+    return (x + 128) % 256 - 128
+
+
+def encode_qoi(frame):
+    '''Encodes an RGB uint8 image of shape (height, width, 3) as QOI bytes'''
+    height, width, _ = frame.shape
+    flat = frame.reshape(-1, 3)
+    count = len(flat)
+
+    # Every pixel is compared to the previous one, starting from black
+    same = flat[1:] == flat[:-1]
+    is_run = np.empty(count, bool)
+    is_run[0] = not flat[0].any()
+    np.logical_and(same[:, 0], same[:, 1], out=is_run[1:])
+    is_run[1:] &= same[:, 2]
+
+    # Runs are between the pixels that are not in a run, and are split into
+    # chunks of at most MAX_RUN pixels
+    others = np.flatnonzero(~is_run)
+    edges = np.concatenate(([-1], others, [count]))
+    run_starts = edges[:-1] + 1
+    run_lengths = edges[1:] - run_starts
+    nonempty = run_lengths > 0
+    run_starts, run_lengths = run_starts[nonempty], run_lengths[nonempty]
+    chunks = -(-run_lengths // MAX_RUN)
+    first_chunk = np.cumsum(chunks) - chunks
+    chunk = np.arange(chunks.sum()) - np.repeat(first_chunk, chunks)
+    chunk_lengths = np.minimum(
+        np.repeat(run_lengths, chunks) - chunk * MAX_RUN, MAX_RUN
+    )
+    chunk_ends = (
+        np.repeat(run_starts, chunks) + chunk * MAX_RUN + chunk_lengths - 1
+    )
+
+    # Everything else is only computed for the pixels that are not in a run,
+    # which are few in frames with large areas of the same color
+    pixels = flat[others].astype(np.int32)
+    previous = flat[np.maximum(others - 1, 0)].astype(np.int32)
+    if len(others) and others[0] == 0:
+        previous[0] = 0
+    packed = pixels[:, 0] * 65536 + pixels[:, 1] * 256 + pixels[:, 2]
+
+    # Alpha is always 255, which adds 255 * 11 to the hash
+    hashes = (
+        pixels[:, 0] * 3 + pixels[:, 1] * 5 + pixels[:, 2] * 7 + 255 * 11
+    ) % 64
+    # The index holds the last pixel that was not in a run with every hash
+    is_index = np.zeros(len(others), bool)
+    by_hash = np.argsort(hashes, kind='stable')
+    seen = (hashes[by_hash[1:]] == hashes[by_hash[:-1]]) & (
+        packed[by_hash[1:]] == packed[by_hash[:-1]]
+    )
+    is_index[by_hash[1:][seen]] = True
+
+    dr, dg, db = wrap(pixels - previous).T
+    is_diff = (
+        ~is_index
+        & (-2 <= dr) & (dr < 2) & (-2 <= dg) & (dg < 2) & (-2 <= db) & (db < 2)
+    )
+    dr_dg, db_dg = wrap(dr - dg), wrap(db - dg)
+    is_luma = (
+        ~is_index & ~is_diff
+        & (-32 <= dg) & (dg < 32)
+        & (-8 <= dr_dg) & (dr_dg < 8) & (-8 <= db_dg) & (db_dg < 8)
+    )
+    is_rgb = ~is_index & ~is_diff & ~is_luma
+
+    # Operations are written in the order of the pixels they end at
+    positions = np.concatenate((others, chunk_ends))
+    lengths = np.concatenate(
+        (1 + is_luma + 3 * is_rgb, np.ones_like(chunk_ends))
+    )
+    order = np.argsort(positions)
+    offsets = np.empty(len(positions), np.int64)
+    offsets[order] = np.cumsum(lengths[order]) - lengths[order]
+    data = np.empty(lengths.sum(), np.uint8)
+
+    data[offsets[len(others):]] = OP_RUN | (chunk_lengths - 1)
+    starts = offsets[:len(others)]
+    data[starts[is_index]] = OP_INDEX | hashes[is_index]
+    data[starts[is_diff]] = (
+        OP_DIFF | (dr[is_diff] + 2) << 4 | (dg[is_diff] + 2) << 2
+        | (db[is_diff] + 2)
+    )
+    data[starts[is_luma]] = OP_LUMA | (dg[is_luma] + 32)
+    data[starts[is_luma] + 1] = (
+        (dr_dg[is_luma] + 8) << 4 | (db_dg[is_luma] + 8)
+    )
+    data[starts[is_rgb]] = OP_RGB
+    for channel in range(3):
+        data[starts[is_rgb] + 1 + channel] = pixels[is_rgb, channel]
+
+    header = b'qoif' + struct.pack('>IIBB', width, height, 3, 0)
+    return header + data.tobytes() + PADDING
+
+
+def write_qoi(frame, path):
+    with open(path, 'wb') as f:
+        f.write(encode_qoi(frame))
@@ -0,0 +1,319 @@
+'''Resumable rendering of videos to files, one segment at a time'''
+import json
+import math
+import os
+import shutil
+import subprocess
+
+import proglog
+from moviepy.config import get_setting
+
+from .animate import animate_segment, animate_segment_batch
+from .graphics import (
+    station_number_sprite, transfer_labels_sprite, vertical_text_sprite
+)
+from .metrics import timed_frames
+from .sinks import encode_frames
+from .timeline import (
+    make_timeline, iter_timeline, settings_hash, segment_key, dedup_report
+)
+
+__all__ = ['write_video', 'stream_video']
+
+
+def manifest_path(output):
+    return output + '.manifest.json'
+
+
+def segments_dir(output):
+    return output + '.parts'
+
+
+def load_manifest(output, digest):
+    '''Returns the completed segments of a previous render with the same
+    encoding settings, or an empty manifest if there is none
+    '''
+    try:
+        with open(manifest_path(output), 'r') as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        manifest = None
+
+    if manifest is None or manifest.get('encoding') != digest:
+        # Encoding changed (or first render): nothing can be reused
+        shutil.rmtree(segments_dir(output), ignore_errors=True)
+        manifest = {'encoding': digest, 'segments': {}}
+
+    # Ignore segments whose files have since disappeared
+    manifest['segments'] = {
+        key: filename
+        for key, filename in manifest['segments'].items()
+        if os.path.exists(os.path.join(segments_dir(output), filename))
+    }
+    return manifest
+
+
+def save_manifest(output, manifest):
+    # Write-then-rename so that a crash never leaves a half-written manifest
+    tmp = manifest_path(output) + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp, manifest_path(output))
+
+
+def render_segment(segment, path, fps, codec, settings, batch, write_kwargs):
+    root, ext = os.path.splitext(path)
+    tmp = root + '.partial' + ext
+    if batch:
+        clip = animate_segment_batch(segment, *settings, fps)
+    else:
+        clip = animate_segment(segment, *settings)
+    clip.write_videofile(tmp, fps=fps, codec=codec, audio=False, **write_kwargs)
+    clip.close()
+    os.replace(tmp, path)
+
+
+def concat_files(output, paths, list_path):
+    '''Concatenates video files with the same encoding into the output
+    without re-encoding. Relative paths are relative to the list file
+    '''
+    with open(list_path, 'w') as f:
+        for path in paths:
+            f.write("file '{}'\n".format(path.replace("'", "'\\''")))
+
+    subprocess.run(
+        [
+            get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+            '-f', 'concat', '-safe', '0', '-i', list_path,
+            '-c', 'copy', output
+        ],
+        check=True
+    )
+
+
+def stitch(output, filenames):
+    '''Concatenates the segment files into the output'''
+    list_path = os.path.join(segments_dir(output), 'concat.txt')
+    concat_files(output, filenames, list_path)
+
+
+def write_video(
+    output, constants, station_settings, terminal_settings, state_settings,
+    service_settings, fps, codec=None, keep_segments=False, batch=False,
+    **write_kwargs
+):
+    '''Renders every segment of the timeline into its own file, then stitches
+    them into the output. Returns a DedupReport
+
+    Segments are keyed by the content hash of what they draw, so identical
+    segments are rendered once and their file is reused. Completed segments
+    are recorded in a manifest next to the output; if a render is
+    interrupted, calling this again with the same output path only renders
+    the missing segments.
+    If batch is True, every transition is rendered all at once with
+    render_transition(), which is faster but only approximately equal to
+    drawing every frame (antialiasing of scaled text differs slightly).
+    Extra keyword arguments are passed to VideoClip.write_videofile()
+    '''
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline = make_timeline(
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+    keys = [
+        segment_key(
+            segment, constants, station_settings, terminal_settings,
+            service_settings
+        )
+        for segment in timeline
+    ]
+    digest = settings_hash(fps, codec, batch, write_kwargs)
+    ext = os.path.splitext(output)[1]
+
+    manifest = load_manifest(output, digest)
+    os.makedirs(segments_dir(output), exist_ok=True)
+
+    for key, segment in zip(keys, timeline):
+        if key in manifest['segments']:
+            continue
+        filename = key + ext
+        render_segment(
+            segment, os.path.join(segments_dir(output), filename),
+            fps, codec, settings, batch, write_kwargs
+        )
+        manifest['segments'][key] = filename
+        save_manifest(output, manifest)
+
+    stitch(output, [manifest['segments'][key] for key in keys])
+
+    if not keep_segments:
+        shutil.rmtree(segments_dir(output))
+        os.remove(manifest_path(output))
+
+    return dedup_report(timeline, keys)
+
+
+def frame_ranges(segments, fps):
+    '''Pairs every segment with the indices of its frames in the whole video'''
+    # Same times as np.arange(0, duration, 1.0 / fps) in iter_frames()
+    step = 1.0 / fps
+    idx = 0
+    for segment in segments:
+        first = idx
+        end = segment.start + segment.duration
+        while idx * step < end:
+            idx += 1
+        yield segment, range(first, idx)
+
+
+def segment_frames(segment, settings, frames, fps, overlay=False):
+    '''Frames of the segment, given the indices of its frames in the whole
+    video
+    '''
+    clip = animate_segment(segment, *settings, overlay=overlay)
+    for idx in frames:
+        yield clip.get_frame(idx * (1.0 / fps) - segment.start)
+    clip.close()
+
+
+def stream_frames(segments, settings, fps, overlay=False):
+    '''Frames at the same times as make_video().iter_frames(), but only the
+    clip of the current segment is alive at any time
+    '''
+    for segment, frames in frame_ranges(segments, fps):
+        for frame in segment_frames(segment, settings, frames, fps, overlay):
+            if overlay and (frame.ndim != 3 or frame.shape[2] != 4):
+                raise ValueError(
+                    f'Overlay frame of segment {segment.index} has shape '
+                    f'{frame.shape}, expected RGBA'
+                )
+            yield frame
+
+
+def frames_key(
+    segment, frames, fps, constants, station_settings, terminal_settings,
+    service_settings
+):
+    '''Content hash of the frames of a segment at the given indices. Unlike
+    segment_key(), this also covers the times the frames are taken at, which
+    depend on where the segment starts
+    '''
+    times = [idx * (1.0 / fps) - segment.start for idx in frames]
+    return settings_hash(
+        segment_key(
+            segment, constants, station_settings, terminal_settings,
+            service_settings
+        ),
+        times
+    )
+
+
+def keyframe_params(frames, fps):
+    '''ffmpeg options that put a keyframe on each of the frames and close
+    every GOP, so the video can be cut at those frames without re-encoding
+    '''
+    # Halfway before the frame, so that rounding of timestamps cannot push
+    # the keyframe to the next frame
+    times = ','.join(f'{max(idx - 0.5, 0) / fps:.6f}' for idx in frames)
+    return ['-force_key_frames', times, '-flags', '+cgop']
+
+
+def segments_path(filename):
+    return filename + '.segments.json'
+
+
+def save_segments(sink, fps, keys, frames):
+    '''Records where every segment starts in a file written by
+    stream_video(), for splice_video()
+    '''
+    with open(segments_path(sink.filename), 'w') as f:
+        json.dump(
+            {'sink': sink._asdict(), 'fps': fps, 'keys': keys, 'frames': frames},
+            f, indent=4
+        )
+
+
+def watch_caches(metrics, frame_store=None):
+    for name, cached in [
+        ('station_numbers', station_number_sprite),
+        ('station_names', vertical_text_sprite),
+        ('transfer_labels', transfer_labels_sprite),
+    ]:
+        metrics.watch_cache(name, lambda cached=cached: cached.cache_info()[:2])
+    if frame_store is not None:
+        metrics.watch_cache(
+            'frame_store', lambda: (frame_store.hits, frame_store.misses)
+        )
+
+
+def stream_video(
+    sinks, constants, station_settings, terminal_settings, state_settings,
+    service_settings, fps, queue_size=16, threads=None, logger='bar',
+    keyframes=False, cache=None, metrics=None
+):
+    '''Renders the video straight into the sinks (see write_sinks()), one
+    segment at a time
+
+    Unlike writing make_video(), which keeps the clips of every segment alive
+    until the end, segments are created lazily from the timeline and freed
+    once their frames are written, so memory does not grow with the length
+    of the video.
+    If keyframes is True, every segment starts with a keyframe, and where
+    they start is recorded next to every file in <filename>.segments.json,
+    so that splice_video() can later replace segments without re-encoding
+    the rest.
+    If cache is a FrameStore, frames that were rendered before are read from
+    it instead of rendered again, and new frames are stored in it.
+    If metrics is given, rendering, encoding and caches are recorded in it
+    '''
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline_settings = (
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+    duration = sum(
+        segment.duration for segment in iter_timeline(*timeline_settings)
+    )
+
+    if keyframes:
+        if any(sink.every != 1 for sink in sinks):
+            raise ValueError('keyframes=True needs every sink to have every=1')
+        keys, starts = [], []
+        for segment, frames in frame_ranges(
+            iter_timeline(*timeline_settings), fps
+        ):
+            keys.append(frames_key(
+                segment, frames, fps, constants, station_settings,
+                terminal_settings, service_settings
+            ))
+            starts.append(frames.start)
+        encoded_sinks = [
+            sink._replace(ffmpeg_params=(
+                keyframe_params(starts, fps) + (sink.ffmpeg_params or [])
+            ))
+            for sink in sinks
+        ]
+    else:
+        encoded_sinks = sinks
+
+    if cache is None:
+        frames = stream_frames(iter_timeline(*timeline_settings), settings, fps)
+    else:
+        frames = cache.stream_frames(
+            iter_timeline(*timeline_settings), settings, fps
+        )
+
+    if metrics is not None:
+        watch_caches(metrics, cache)
+
+    logger = proglog.default_bar_logger(logger)
+    bar = logger.iter_bar(frame_index=range(math.ceil(duration * fps)))
+    encode_frames(
+        timed_frames((frame for _, frame in zip(bar, frames)), metrics),
+        encoded_sinks, (constants.width, constants.height), fps, queue_size,
+        threads, metrics
+    )
+
+    if keyframes:
+        for sink in sinks:
+            save_segments(sink, fps, keys, starts)
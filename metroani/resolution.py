@@ -0,0 +1,88 @@
+'''Rendering the same video at several resolutions at once'''
+import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import proglog
+
+from .animate import animate_segment
+from .render import frame_ranges
+from .sinks import Sink, encode_frame_sets
+from .timeline import iter_timeline
+
+__all__ = ['Resolution', 'stream_resolutions']
+
+
+class Resolution(NamedTuple):
+    '''An output of stream_resolutions(), the width follows from the aspect
+    ratio of the constants
+    '''
+    sink: Sink
+    height: int
+
+    def scale(self, constants):
+        return self.height / constants.height
+
+    def size(self, constants):
+        return (round(constants.width * self.scale(constants)), self.height)
+
+
+def stream_resolutions(
+    resolutions, constants, station_settings, terminal_settings,
+    state_settings, service_settings, fps, workers=None, queue_size=16,
+    threads=None, logger='bar'
+):
+    '''Renders the video at every resolution in one pass, like stream_video()
+
+    All resolutions share the timeline and the layout, which is in the
+    coordinates of the constants (width, height). Every resolution is
+    rasterized natively from the same drawing rather than resized, and the
+    frames of all resolutions are rendered in parallel by a pool of workers.
+    For example, for signage with different panels:
+    >>> stream_resolutions([
+    ...     Resolution(Sink('line_720.mp4'), 720),
+    ...     Resolution(Sink('line_1080.mp4'), 1080),
+    ...     Resolution(Sink('line_2160.mp4'), 2160),
+    ... ], *settings_from_json('settings/full.json'), fps=30)
+    '''
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline_settings = (
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+    duration = sum(
+        segment.duration for segment in iter_timeline(*timeline_settings)
+    )
+    # Resolutions with the same height are only rendered once
+    scales = sorted({resolution.scale(constants) for resolution in resolutions})
+    step = 1.0 / fps
+
+    def frame_sets(pool):
+        for segment, frames in frame_ranges(
+            iter_timeline(*timeline_settings), fps
+        ):
+            clips = [
+                animate_segment(segment, *settings, scale=scale)
+                for scale in scales
+            ]
+            for idx in frames:
+                t = idx * step - segment.start
+                rendered = dict(zip(
+                    scales, pool.map(lambda clip: clip.get_frame(t), clips)
+                ))
+                yield tuple(
+                    rendered[resolution.scale(constants)]
+                    for resolution in resolutions
+                )
+            for clip in clips:
+                clip.close()
+
+    logger = proglog.default_bar_logger(logger)
+    bar = logger.iter_bar(frame_index=range(math.ceil(duration * fps)))
+    with ThreadPoolExecutor(workers) as pool:
+        encode_frame_sets(
+            (frames for _, frames in zip(bar, frame_sets(pool))),
+            [resolution.sink for resolution in resolutions],
+            [resolution.size(constants) for resolution in resolutions],
+            fps, queue_size, threads
+        )
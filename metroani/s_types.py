@@ -20,6 +20,10 @@ class Constants(NamedTuple):
     icon_line_fontsize: int
     icon_station_fontsize: int
     show_direction: bool
+    loop: bool = False  # Circular line, the last station is followed by the first
+    animate_arrow: bool = False  # Move the arrow across skipped stations
+    flash_arrow: bool = False
+    animate_transfers: bool = False  # Change languages of transfer lines
 
 
 class LineTranslation(NamedTuple):
@@ -0,0 +1,112 @@
+'''Exporting videos as numbered image files, for compositing software'''
+import math
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import proglog
+from PIL import Image
+
+from .qoi import write_qoi
+from .render import stream_frames
+from .timeline import iter_timeline
+
+__all__ = ['write_sequence']
+
+
+def save_image(frame, path, image_format, save_kwargs):
+    if image_format == 'qoi':
+        # Pillow's QOI encoder is written in Python and is slower than PNG
+        write_qoi(frame, path)
+    else:
+        Image.fromarray(frame).save(path, format=image_format, **save_kwargs)
+
+
+def link_or_copy(source, path):
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(source, path)
+    except OSError:
+        # Hard links are not supported by every file system
+        shutil.copyfile(source, path)
+
+
+def write_sequence(
+    directory, constants, station_settings, terminal_settings, state_settings,
+    service_settings, fps, image_format='png', compress_level=1, workers=None,
+    cache=None, logger='bar', overlay=False, **save_kwargs
+):
+    '''Writes every frame of the video as an image, named 000000.png,
+    000001.png... in the directory. Returns the number of frames that were
+    encoded and the number that were linked
+
+    image_format is 'png', 'qoi' (a lossless format that is faster to write
+    than PNG, and is read by ffmpeg) or any other format that Pillow can
+    write. compress_level is the zlib level of PNGs, from 0 (fastest) to 9
+    (smallest). Frames are encoded by a pool of worker threads; frames that are the same as the
+    previous one, such as in freezes, are hard links to its file instead.
+    If cache is a FrameStore, frames are read from it like in stream_video().
+    If overlay is True, frames are RGBA overlays without the background, see
+    write_overlay(); QOI and caches are not supported for them.
+    Extra keyword arguments are passed to PIL.Image.save(), except for QOI
+    '''
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline_settings = (
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+    duration = sum(
+        segment.duration for segment in iter_timeline(*timeline_settings)
+    )
+    workers = workers or os.cpu_count() or 1
+    image_format = image_format.lower()
+    if overlay and (image_format == 'qoi' or cache is not None):
+        raise ValueError('Overlays are not supported with QOI or a cache')
+    if image_format == 'png':
+        save_kwargs['compress_level'] = compress_level
+    os.makedirs(directory, exist_ok=True)
+
+    if cache is None:
+        frames = stream_frames(
+            iter_timeline(*timeline_settings), settings, fps, overlay
+        )
+    else:
+        frames = cache.stream_frames(
+            iter_timeline(*timeline_settings), settings, fps
+        )
+    logger = proglog.default_bar_logger(logger)
+    bar = logger.iter_bar(frame_index=range(math.ceil(duration * fps)))
+
+    # Links are made at the end, once the files they link to are written
+    links = []
+    encoded = 0
+    with ThreadPoolExecutor(workers) as pool:
+        # Bound the frames in memory that are waiting to be encoded
+        pending = deque()
+        max_pending = 2 * workers
+        previous = source = None
+        for idx, frame in zip(bar, frames):
+            path = os.path.join(directory, f'{idx:06d}.{image_format}')
+            if previous is not None and (
+                frame is previous or np.array_equal(frame, previous)
+            ):
+                links.append((source, path))
+                continue
+
+            pending.append(pool.submit(
+                save_image, frame, path, image_format, save_kwargs
+            ))
+            encoded += 1
+            previous, source = frame, path
+            while len(pending) > max_pending:
+                pending.popleft().result()
+
+        for future in pending:
+            future.result()
+
+    for source, path in links:
+        link_or_copy(source, path)
+    return encoded, len(links)
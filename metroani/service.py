@@ -0,0 +1,181 @@
+'''Rendering videos in worker processes from asyncio, for example from a web
+backend, with progress events and cancellation
+'''
+from __future__ import annotations
+import asyncio
+import bisect
+import multiprocessing
+import os
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import NamedTuple, Optional
+
+import proglog
+
+from .atlas import atlas_path, load_atlas, use_atlas
+from .metroani import settings_from_json
+from .render import frame_ranges, stream_video
+from .sinks import Sink
+from .timeline import iter_timeline
+
+__all__ = ['RenderService', 'RenderJob', 'Progress', 'RenderCancelled']
+
+
+class RenderCancelled(Exception):
+    pass
+
+
+class Progress(NamedTuple):
+    segments_done: int
+    segments: int
+    frames_done: int
+    frames: int
+    fps: float  # Frames rendered per second so far
+    eta: Optional[float]  # Seconds until done, None before the first frame
+
+    @property
+    def done(self) -> bool:
+        return self.frames_done >= self.frames
+
+
+class ProgressLogger(proglog.ProgressBarLogger):
+    '''Puts the Progress of stream_video() in a queue at most every interval
+    seconds, and stops the render when cancel is set
+    '''
+    def __init__(self, events, cancel, ends, interval):
+        super().__init__()
+        self.events = events
+        self.cancel = cancel
+        self.ends = ends  # Index after the last frame of every segment
+        self.interval = interval
+        self.start = time.perf_counter()
+        self.last_event = 0
+
+    def progress(self, frames_done):
+        elapsed = time.perf_counter() - self.start
+        frames = self.ends[-1] if self.ends else 0
+        fps = frames_done / elapsed if elapsed else 0
+        eta = (frames - frames_done) / fps if fps else None
+        return Progress(
+            bisect.bisect_right(self.ends, frames_done), len(self.ends),
+            frames_done, frames, fps, eta
+        )
+
+    def bars_callback(self, bar, attr, value, old_value=None):
+        if attr != 'index':
+            return
+        # Checked before every frame, so cancelling stops within a frame
+        if self.cancel.is_set():
+            raise RenderCancelled()
+        now = time.perf_counter()
+        if now - self.last_event >= self.interval:
+            self.last_event = now
+            self.events.put(self.progress(value))
+
+
+def run_job(settings, sinks, fps, options, events, cancel, interval):
+    '''Renders a job in a worker process'''
+    if isinstance(settings, str):
+        # Sprites that were rasterized ahead of time, see atlas.py
+        path = atlas_path(settings)
+        use_atlas(load_atlas(path) if os.path.exists(path + '.json') else None)
+        settings = settings_from_json(settings)
+    sinks = [Sink(sink) if isinstance(sink, str) else sink for sink in sinks]
+    ends = [
+        frames.stop for _, frames in frame_ranges(iter_timeline(*settings), fps)
+    ]
+    logger = ProgressLogger(events, cancel, ends, interval)
+    try:
+        stream_video(sinks, *settings, fps=fps, logger=logger, **options)
+    except RenderCancelled:
+        # Do not leave half-written videos behind
+        for sink in sinks:
+            if os.path.exists(sink.filename):
+                os.remove(sink.filename)
+        raise
+    events.put(logger.progress(ends[-1] if ends else 0))
+
+
+class RenderJob:
+    '''A render submitted to a RenderService. Await it for its completion,
+    which raises RenderCancelled if it was cancelled
+    '''
+    def __init__(self, future, events, cancel_event):
+        self.future = future
+        self.events = events
+        self.cancel_event = cancel_event
+
+    def cancel(self):
+        '''Stops the render before its next frame, or before it starts'''
+        self.cancel_event.set()
+        if self.future.cancel():
+            self.events.put(None)
+
+    def done(self):
+        return self.future.done()
+
+    async def progress(self):
+        '''Yields Progress events until the job is done'''
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                event = await loop.run_in_executor(
+                    None, self.events.get, True, 0.2
+                )
+            except queue.Empty:
+                if self.future.done() and self.events.empty():
+                    return
+                continue
+            if event is None:
+                return
+            yield event
+
+    async def wait(self):
+        try:
+            return await asyncio.wrap_future(self.future)
+        except asyncio.CancelledError:
+            if self.cancel_event.is_set():
+                raise RenderCancelled() from None
+            raise
+
+    def __await__(self):
+        return self.wait().__await__()
+
+
+class RenderService:
+    '''Schedules renders on a pool of worker processes
+
+    >>> async with RenderService(max_workers=2) as service:
+    ...     job = service.submit('settings/full.json', ['full.mp4'], fps=24)
+    ...     async for progress in job.progress():
+    ...         print(progress.frames_done, progress.eta)
+    ...     await job
+
+    Settings are either a JSON file or the tuple of settings objects from
+    settings_from_json(), outputs are file names or Sinks, and other keyword
+    arguments are passed to stream_video()
+    '''
+    def __init__(self, max_workers=None, progress_interval=0.5):
+        self.pool = ProcessPoolExecutor(max_workers)
+        self.manager = multiprocessing.Manager()
+        self.progress_interval = progress_interval
+
+    def submit(self, settings, sinks, fps, **options) -> RenderJob:
+        events = self.manager.Queue()
+        cancel = self.manager.Event()
+        future = self.pool.submit(
+            run_job, settings, sinks, fps, options, events, cancel,
+            self.progress_interval
+        )
+        return RenderJob(future, events, cancel)
+
+    def shutdown(self):
+        self.pool.shutdown(cancel_futures=True)
+        self.manager.shutdown()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await asyncio.get_running_loop().run_in_executor(None, self.shutdown)
@@ -0,0 +1,158 @@
+'''Writing one render to several files at once'''
+from __future__ import annotations
+import os
+import queue
+import threading
+import time
+from typing import NamedTuple, Optional
+
+from moviepy.tools import extensions_dict
+from moviepy.video.fx import resize
+from moviepy.video.io.ffmpeg_writer import FFMPEG_VideoWriter
+
+from .metrics import timed_frames
+
+__all__ = ['Sink', 'write_sinks']
+
+
+class Sink(NamedTuple):
+    '''An output file of write_sinks() and how to encode it'''
+    filename: str
+    codec: Optional[str] = None  # Default depends on the file extension
+    every: int = 1  # Keep every n-th frame, so fps is divided by this
+    resize: float = 1  # Same as VideoClip.resize()
+    bitrate: Optional[str] = None
+    ffmpeg_params: Optional[list[str]] = None
+    alpha: bool = False  # Frames are RGBA, for codecs with alpha
+
+
+def default_codec(filename):
+    ext = os.path.splitext(filename)[1][1:].lower()
+    if ext == 'gif':
+        return 'gif'
+    try:
+        return extensions_dict[ext]['codec'][0]
+    except KeyError:
+        raise ValueError(
+            f'No default codec for {filename}, please set the codec of the Sink'
+        ) from None
+
+
+class SinkWriter:
+    '''Encodes the frames of a sink in its own thread
+
+    The queue is bounded, so a sink that encodes slower than the frames are
+    rendered blocks the renderer instead of buffering every frame in memory
+    '''
+    def __init__(self, sink, size, fps, queue_size, threads, metrics=None):
+        self.sink = sink
+        self.metrics = metrics
+        self.size = [round(x * sink.resize) for x in size]
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.error = None
+        self.writer = FFMPEG_VideoWriter(
+            sink.filename, self.size, fps / sink.every,
+            codec=sink.codec or default_codec(sink.filename),
+            bitrate=sink.bitrate, withmask=sink.alpha,
+            ffmpeg_params=sink.ffmpeg_params, threads=threads
+        )
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while (frame := self.queue.get()) is not None:
+            if self.error is not None:
+                # Keep draining so that the renderer never blocks on us
+                continue
+            try:
+                if self.sink.resize != 1:
+                    # Only defined if OpenCV, Pillow or SciPy is installed
+                    frame = resize.resizer(frame, self.size)
+                start = time.perf_counter()
+                self.writer.write_frame(frame)
+                if self.metrics is not None:
+                    self.metrics.observe(
+                        'encode_seconds', time.perf_counter() - start,
+                        sink=self.sink.filename
+                    )
+                    self.metrics.count('frames_encoded', sink=self.sink.filename)
+            except Exception as e:
+                self.error = e
+
+    def put(self, idx, frame):
+        if idx % self.sink.every == 0:
+            self.queue.put(frame)
+            if self.metrics is not None:
+                self.metrics.set(
+                    'queue_depth', self.queue.qsize(), sink=self.sink.filename
+                )
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.writer.close()
+        if self.error is not None:
+            raise self.error
+
+
+def encode_frame_sets(
+    frame_sets, sinks, sizes, fps, queue_size=16, threads=None, metrics=None
+):
+    '''Encodes an iterable of tuples with one frame for every sink, where
+    sizes[i] is the size (width, height) of the frames of sinks[i]
+    '''
+    writers = []
+    try:
+        for sink, size in zip(sinks, sizes):
+            writers.append(
+                SinkWriter(sink, size, fps, queue_size, threads, metrics)
+            )
+
+        for idx, frames in enumerate(frame_sets):
+            for writer, frame in zip(writers, frames):
+                writer.put(idx, frame)
+            if (failed := next((w for w in writers if w.error), None)):
+                raise failed.error
+    finally:
+        errors = []
+        for writer in writers:
+            try:
+                writer.close()
+            except Exception as e:
+                errors.append(e)
+    if errors:
+        raise errors[0]
+
+
+def encode_frames(
+    frames, sinks, size, fps, queue_size=16, threads=None, metrics=None
+):
+    '''Encodes every frame of an iterable of frames with the given size
+    (width, height) into every sink
+    '''
+    encode_frame_sets(
+        ((frame,) * len(sinks) for frame in frames),
+        sinks, [size] * len(sinks), fps, queue_size, threads, metrics
+    )
+
+
+def write_sinks(
+    clip, sinks, fps, queue_size=16, threads=None, logger='bar', metrics=None
+):
+    '''Renders every frame of the clip once and encodes it into every sink
+
+    For example, the webm and gif of the examples in one pass:
+    >>> write_sinks(video, [
+    ...     Sink('example.webm', codec='libvpx'),
+    ...     Sink('example.gif', resize=0.5),
+    ... ], fps=24)
+
+    At most queue_size frames are buffered per sink. If metrics is given,
+    rendering and encoding are recorded in it
+    '''
+    encode_frames(
+        timed_frames(
+            clip.iter_frames(fps=fps, dtype='uint8', logger=logger), metrics
+        ),
+        sinks, clip.size, fps, queue_size, threads, metrics
+    )
@@ -0,0 +1,117 @@
+'''Replacing segments of a video written by stream_video() without
+re-encoding the rest
+'''
+import json
+import os
+import shutil
+import subprocess
+
+from moviepy.config import get_setting
+
+from .render import (
+    concat_files, frame_ranges, frames_key, keyframe_params, save_segments,
+    segment_frames, segments_path
+)
+from .sinks import Sink, encode_frames
+from .timeline import make_timeline
+
+__all__ = ['splice_video']
+
+
+def load_segments(filename):
+    try:
+        with open(segments_path(filename), 'r') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        raise FileNotFoundError(
+            f'{segments_path(filename)} not found, please write {filename} '
+            'with stream_video(keyframes=True) first'
+        ) from None
+
+
+def split(filename, frames, directory):
+    '''Cuts the video into one file per segment without re-encoding, given
+    the (keyframe) index of the first frame of every segment
+    '''
+    ext = os.path.splitext(filename)[1]
+    pattern = os.path.join(directory, f'old%06d{ext}')
+    if len(frames) > 1:
+        cuts = ['-segment_frames', ','.join(str(idx) for idx in frames[1:])]
+    else:
+        cuts = []
+    subprocess.run(
+        [
+            get_setting('FFMPEG_BINARY'), '-y', '-loglevel', 'error',
+            '-i', filename, '-map', '0', '-c', 'copy',
+            '-f', 'segment', *cuts, '-reset_timestamps', '1', pattern
+        ],
+        check=True
+    )
+    return [pattern % idx for idx in range(len(frames))]
+
+
+def splice_video(
+    filename, constants, station_settings, terminal_settings, state_settings,
+    service_settings, threads=None
+):
+    '''Updates a video written by stream_video(keyframes=True) to new
+    settings, for example after a station was renamed. Returns the number of
+    segments that were rendered
+
+    Segments that are drawn the same as before are copied from the video
+    without re-encoding, segments that are no longer in the timeline are
+    dropped, and only new or changed segments are rendered, with the same
+    Sink as before
+    '''
+    recorded = load_segments(filename)
+    sink = Sink(**recorded['sink'])
+    fps = recorded['fps']
+    settings = (station_settings, terminal_settings, constants, service_settings)
+    timeline = make_timeline(
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    )
+
+    root, ext = os.path.splitext(filename)
+    directory = filename + '.splice'
+    shutil.rmtree(directory, ignore_errors=True)
+    os.makedirs(directory)
+    try:
+        old = dict(zip(
+            recorded['keys'], split(filename, recorded['frames'], directory)
+        ))
+
+        keys, starts, paths = [], [], []
+        rendered = 0
+        for idx, (segment, frames) in enumerate(frame_ranges(timeline, fps)):
+            key = frames_key(
+                segment, frames, fps, constants, station_settings,
+                terminal_settings, service_settings
+            )
+            keys.append(key)
+            starts.append(frames.start)
+            if key in old:
+                paths.append(old[key])
+                continue
+
+            path = os.path.join(directory, f'new{idx:06d}{ext}')
+            encode_frames(
+                segment_frames(segment, settings, frames, fps),
+                [sink._replace(filename=path, ffmpeg_params=(
+                    keyframe_params([0], fps) + (sink.ffmpeg_params or [])
+                ))],
+                (constants.width, constants.height), fps, threads=threads
+            )
+            paths.append(path)
+            rendered += 1
+
+        tmp = root + '.partial' + ext
+        concat_files(
+            tmp, [os.path.abspath(path) for path in paths],
+            os.path.join(directory, 'concat.txt')
+        )
+        os.replace(tmp, filename)
+        save_segments(sink, fps, keys, starts)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    return rendered
@@ -0,0 +1,301 @@
+'''Surfaces that graphics are drawn on, at any resolution
+
+There are two backends with the same drawing methods, which take the same
+arguments as the gizeh functions of the same name:
+
+- GizehSurface draws every shape as a gizeh element. gizeh builds a Python
+  object, composes its matrix with numpy and creates a new cairo context for
+  every shape
+- CairoSurface draws directly on a single cairo context that is reused for
+  every shape, with font faces that are only created once
+
+Both draw the same paths with the same matrices and sources, so the frames
+should be identical; compare them with benchmark.py before switching
+'''
+from functools import lru_cache
+
+import cairocffi as cairo
+import gizeh as gz
+import numpy as np
+
+__all__ = ['set_backend']
+
+
+class ScaledContext(cairo.Context):
+    '''Context that scales everything drawn on it
+
+    gizeh replaces the matrix of the context with the matrix of every element
+    it draws, so the scale is applied on top of every new matrix
+    '''
+    def __init__(self, target, scale):
+        super().__init__(target)
+        self.scale_matrix = cairo.Matrix(xx=scale, yy=scale)
+        super().set_matrix(self.scale_matrix)
+
+    def set_matrix(self, matrix):
+        super().set_matrix(matrix.multiply(self.scale_matrix))
+
+
+class GizehSurface(gz.Surface):
+    '''Surface of (width * scale, height * scale) pixels that is drawn on with
+    coordinates from (0, 0) to (width, height), so graphics laid out for one
+    resolution are rasterized natively at another
+    '''
+    def __init__(self, width, height, scale=1, bg_color=None):
+        self.scale = scale
+        super().__init__(round(width * scale), round(height * scale))
+        if bg_color:
+            self.rectangle(2 * width, 2 * height, fill=bg_color)
+
+    def get_new_context(self):
+        if self.scale == 1:
+            return super().get_new_context()
+        return ScaledContext(self._cairo_surface, self.scale)
+
+    def rectangle(self, lx, ly, **kwargs):
+        gz.rectangle(lx, ly, **kwargs).draw(self)
+
+    def square(self, l, **kwargs):
+        gz.square(l, **kwargs).draw(self)
+
+    def circle(self, r, **kwargs):
+        gz.circle(r, **kwargs).draw(self)
+
+    def polyline(self, points, close_path=False, **kwargs):
+        gz.polyline(points, close_path=close_path, **kwargs).draw(self)
+
+    def text(
+        self, txt, fontfamily, fontsize, xy, fill=(0, 0, 0), scale_x=1,
+        scale_y=1, center=(0, 0)
+    ):
+        '''Text centered at xy, scaled around center'''
+        element = gz.text(txt, fontfamily, fontsize, xy=xy, fill=fill)
+        if (scale_x, scale_y) != (1, 1):
+            element = element.scale(rx=scale_x, ry=scale_y, center=center)
+        element.draw(self)
+
+    @staticmethod
+    def load_image(image):
+        '''Prepares an RGBA image (as returned by get_npimage()) to be drawn'''
+        return gz.ImagePattern(image, filter='nearest')
+
+    def draw_image(self, image, x, y, width, height):
+        '''Draws an image from load_image() with its top left corner at the
+        pixel (x, y) of the surface
+        '''
+        scale = self.scale
+        right = x + width
+        bottom = y + height
+        self.polyline(
+            [
+                (x / scale, y / scale), (right / scale, y / scale),
+                (right / scale, bottom / scale), (x / scale, bottom / scale),
+            ],
+            close_path=True,
+            fill=image.scale(scale).translate([-x, -y])
+        )
+
+
+@lru_cache(maxsize=None)
+def font_face(fontfamily):
+    return cairo.ToyFontFace(fontfamily)
+
+
+def set_source(ctx, source):
+    if isinstance(source, cairo.Pattern):
+        ctx.set_source(source)
+    elif len(source) == 4:
+        ctx.set_source_rgba(*source)
+    else:
+        ctx.set_source_rgb(*source)
+
+
+class CairoSurface:
+    '''Same as GizehSurface, but draws directly on one cairo context'''
+    def __init__(self, width, height, scale=1, bg_color=None):
+        self.scale = scale
+        self.width = round(width * scale)
+        self.height = round(height * scale)
+        self._cairo_surface = cairo.ImageSurface(
+            cairo.FORMAT_ARGB32, self.width, self.height
+        )
+        self.context = cairo.Context(self._cairo_surface)
+        self.scale_matrix = cairo.Matrix(xx=scale, yy=scale)
+        if bg_color:
+            self.rectangle(2 * width, 2 * height, fill=bg_color)
+
+    def begin(self, xx=1, yy=1, x0=0, y0=0):
+        '''Starts a new shape with the given matrix, like a new context'''
+        ctx = self.context
+        ctx.new_path()
+        ctx.set_matrix(
+            cairo.Matrix(xx, 0, 0, yy, x0, y0).multiply(self.scale_matrix)
+        )
+        return ctx
+
+    def shape(self, fill, stroke, stroke_width):
+        '''Fills and strokes the current path'''
+        ctx = self.context
+        if fill is not None:
+            set_source(ctx, fill)
+            ctx.fill_preserve()
+        if stroke_width > 0:
+            ctx.set_line_width(stroke_width)
+            set_source(ctx, stroke)
+            ctx.stroke()
+
+    def rectangle(
+        self, lx, ly, xy=(0, 0), fill=None, stroke=(0, 0, 0), stroke_width=0
+    ):
+        ctx = self.begin(x0=xy[0], y0=xy[1])
+        ctx.rectangle(-lx / 2, -ly / 2, lx, ly)
+        self.shape(fill, stroke, stroke_width)
+
+    def square(self, l, **kwargs):
+        self.rectangle(l, l, **kwargs)
+
+    def circle(
+        self, r, xy=(0, 0), fill=None, stroke=(0, 0, 0), stroke_width=0
+    ):
+        ctx = self.begin(x0=xy[0], y0=xy[1])
+        ctx.arc(0, 0, r, 0, 2 * np.pi)
+        self.shape(fill, stroke, stroke_width)
+
+    def polyline(
+        self, points, close_path=False, xy=(0, 0), fill=None,
+        stroke=(0, 0, 0), stroke_width=0
+    ):
+        ctx = self.begin(x0=xy[0], y0=xy[1])
+        ctx.move_to(*points[0])
+        for point in points[1:]:
+            ctx.line_to(*point)
+        if close_path:
+            ctx.close_path()
+        self.shape(fill, stroke, stroke_width)
+
+    def text(
+        self, txt, fontfamily, fontsize, xy, fill=(0, 0, 0), scale_x=1,
+        scale_y=1, center=(0, 0)
+    ):
+        '''Text centered at xy, scaled around center'''
+        cx, cy = center
+        ctx = self.begin(
+            scale_x, scale_y, cx - scale_x * cx, cy - scale_y * cy
+        )
+        ctx.set_font_face(font_face(fontfamily))
+        ctx.set_font_size(fontsize)
+        xbear, ybear, w, h, _, _ = ctx.text_extents(txt)
+        ctx.move_to(xy[0] + (-w / 2 - xbear), xy[1] + (-h / 2 - ybear))
+        ctx.text_path(txt)
+        set_source(ctx, fill)
+        ctx.fill()
+
+    @staticmethod
+    def load_image(image):
+        '''Prepares an RGBA image (as returned by get_npimage()) to be drawn'''
+        height, width, _ = image.shape
+        surface = cairo.ImageSurface(cairo.FORMAT_ARGB32, width, height)
+        data = np.frombuffer(surface.get_data(), np.uint8)
+        data[:] = image[:, :, [2, 1, 0, 3]].ravel()
+        surface.mark_dirty()
+        return surface
+
+    def draw_image(self, image, x, y, width, height):
+        '''Draws an image from load_image() with its top left corner at the
+        pixel (x, y) of the surface
+        '''
+        # A new pattern every time, as images are shared between threads
+        pattern = cairo.SurfacePattern(image)
+        pattern.set_filter(cairo.FILTER_NEAREST)
+        pattern.set_matrix(cairo.Matrix(self.scale, 0, 0, self.scale, -x, -y))
+        scale = self.scale
+        right = x + width
+        bottom = y + height
+        self.polyline(
+            [
+                (x / scale, y / scale), (right / scale, y / scale),
+                (right / scale, bottom / scale), (x / scale, bottom / scale),
+            ],
+            close_path=True, fill=pattern
+        )
+
+    def get_npimage(self, transparent=False):
+        self._cairo_surface.flush()
+        image = np.frombuffer(self._cairo_surface.get_data(), np.uint8)
+        image = image.reshape(self.height, self.width, 4)[:, :, [2, 1, 0, 3]]
+        return image if transparent else image[:, :, :3]
+
+
+def unpremultiply(image):
+    '''Straight RGBA of an RGBA image with premultiplied colors, as cairo
+    draws them, for image and video formats with alpha
+    '''
+    alpha = image[:, :, 3:].astype(np.uint16)
+    rgb = image[:, :, :3].astype(np.uint16) * 255 + alpha // 2
+    np.floor_divide(rgb, alpha, out=rgb, where=alpha > 0)
+    rgb[np.broadcast_to(alpha == 0, rgb.shape)] = 0
+    return np.concatenate(
+        [np.minimum(rgb, 255).astype(np.uint8), image[:, :, 3:]], axis=2
+    )
+
+
+class RecordingSurface:
+    '''Records the drawing methods called on it instead of drawing, as a list
+    of (method of the backend, args, kwargs) to be called on surfaces of the
+    backend later
+    '''
+    methods = (
+        'rectangle', 'square', 'circle', 'polyline', 'text', 'draw_image'
+    )
+
+    def __init__(self, backend, scale=1):
+        self.backend = backend
+        self.scale = scale
+        self.operations = []
+
+    def __getattr__(self, name):
+        if name not in self.methods:
+            raise AttributeError(name)
+        method = getattr(self.backend, name)
+
+        def record(*args, **kwargs):
+            self.operations.append((method, args, kwargs))
+        return record
+
+    def load_image(self, image):
+        return self.backend.load_image(image)
+
+
+BACKENDS = {'gizeh': GizehSurface, 'cairo': CairoSurface}
+backend = GizehSurface
+
+
+def set_backend(name):
+    '''Selects the backend that frames are drawn with, 'gizeh' (the default)
+    or 'cairo'
+    '''
+    global backend
+    try:
+        backend = BACKENDS[name]
+    except KeyError:
+        raise ValueError(
+            f'Unknown backend {name}, expected one of {", ".join(BACKENDS)}'
+        ) from None
+
+
+def get_backend():
+    return backend
+
+
+def make_surface(width, height, scale=1, bg_color=None):
+    return backend(width, height, scale, bg_color=bg_color)
+
+
+def surface_backend(surface):
+    '''The class of the surfaces that the surface draws like'''
+    return getattr(surface, 'backend', type(surface))
+
+
+def surface_scale(surface):
+    '''Pixels of the surface per unit of drawing coordinates'''
+    return getattr(surface, 'scale', 1)
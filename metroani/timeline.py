@@ -0,0 +1,139 @@
+'''Flat, ordered list of every segment that makes up a video'''
+from __future__ import annotations
+import hashlib
+import json
+from typing import NamedTuple
+
+from .s_types import Constants, Transition, StationTranslation, TerminusTranslation
+from .utils import pairs, station_window, line_continues
+
+
+class Segment(NamedTuple):
+    '''A single language transition of a train state at a station,
+    including the freezes before and/or after it
+    '''
+    index: int
+    n: int  # Station index
+    state: int  # Index in state_settings
+    pair: int  # Index of the language pair, decides the freezes
+    start: float  # Seconds since the start of the video
+    duration: float  # Transition plus freezes
+    next_settings: Transition
+    old: StationTranslation
+    new: StationTranslation
+    old_next: StationTranslation
+    new_next: StationTranslation
+    old_term: TerminusTranslation
+    new_term: TerminusTranslation
+    old_service: StationTranslation
+    new_service: StationTranslation
+
+    @property
+    def freeze_start(self) -> bool:
+        return self.pair % 2 == 0
+
+    @property
+    def arrow_moves(self) -> bool:
+        '''The arrow only moves to the station in its first segment'''
+        return self.state == 0 and self.pair == 0
+
+
+def segment_duration(pair: int, constants: Constants) -> float:
+    freezes = 2 if pair % 2 == 0 else 1
+    return constants.duration + constants.freeze_duration * freezes
+
+
+def iter_timeline(
+    constants, station_settings, terminal_settings, state_settings, service_settings
+):
+    '''Yields the segments of make_timeline() one at a time'''
+    start = 0 if constants.show_direction else 1
+    index = 0
+    time = 0
+    for n in range(start, len(station_settings)):
+        if station_settings[n].skip:
+            continue
+        for state, next_settings in enumerate(state_settings):
+            for pair, (names, next_, terminal, services) in enumerate(zip(
+                pairs(station_settings[n].names), pairs(next_settings.names),
+                pairs(terminal_settings.names), pairs(service_settings.names)
+            )):
+                duration = segment_duration(pair, constants)
+                yield Segment(
+                    index, n, state, pair, time, duration,
+                    next_settings, *names, *next_, *terminal, *services
+                )
+                index += 1
+                time += duration
+
+
+def make_timeline(
+    constants, station_settings, terminal_settings, state_settings, service_settings
+) -> list[Segment]:
+    '''Lists the segments in the same order as make_video() would show them'''
+    return list(iter_timeline(
+        constants, station_settings, terminal_settings, state_settings,
+        service_settings
+    ))
+
+
+def settings_hash(*values) -> str:
+    '''Content hash of any combination of settings objects and plain values'''
+    dump = json.dumps(values, sort_keys=True, default=str)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()
+
+
+def segment_key(
+    segment, constants, station_settings, terminal_settings, service_settings
+) -> str:
+    '''Content hash of everything that is drawn in a segment.
+    Segments with the same key are pixel-identical
+    '''
+    n = segment.n
+    settings_to_show, arrow_position = station_window(
+        station_settings, n, loop=constants.loop
+    )
+    return settings_hash(
+        constants,
+        n == 0,
+        station_settings[n].xy,
+        station_settings[n].station_number,
+        settings_to_show,
+        arrow_position,
+        line_continues(station_settings, n, constants.loop),
+        terminal_settings.xy,
+        terminal_settings.terminus_number,
+        segment.next_settings.xy,
+        service_settings.xy,
+        segment.freeze_start,
+        # Only makes a difference if the arrow is animated
+        constants.animate_arrow and segment.arrow_moves,
+        segment[segment._fields.index('old'):],
+    )
+
+
+class DedupReport(NamedTuple):
+    '''How many segments of a timeline are duplicates of another'''
+    segments: int
+    unique: int
+    duration: float  # Seconds of video
+    unique_duration: float  # Seconds of video that needs to be rendered
+
+    def __str__(self):
+        saved = self.duration - self.unique_duration
+        percent = 100 * saved / self.duration if self.duration else 0
+        return (
+            f'{self.segments - self.unique} of {self.segments} segments are '
+            f'duplicates; {saved:.1f}s of {self.duration:.1f}s '
+            f'({percent:.0f}%) does not need to be rendered'
+        )
+
+
+def dedup_report(timeline, keys) -> DedupReport:
+    unique = dict(zip(keys, timeline))
+    return DedupReport(
+        len(timeline),
+        len(unique),
+        sum(segment.duration for segment in timeline),
+        sum(segment.duration for segment in unique.values()),
+    )
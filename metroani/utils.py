@@ -12,14 +12,17 @@ def pairs(lst):
     return sliding_window(2, chain(lst, [lst[0]]))
 
 
-def find_prev_unskipped_station(station_idx, settings):
+def find_prev_unskipped_station(station_idx, settings, loop=False):
     '''
     Number of stations between current station to the previous station
     that is not skipped
     '''
-    for idx, setting in enumerate(reversed(settings[:station_idx])):
-        if not setting.skip:
-            return idx + 1  # Number of stations, not the index
+    # Walk back by index instead of copying the list, so this only costs as
+    # much as the number of skipped stations, however long the line is
+    count = len(settings) - 1 if loop else station_idx
+    for idx in range(1, count + 1):
+        if not settings[(station_idx - idx) % len(settings)].skip:
+            return idx  # Number of stations, not the index
 
     # Warnings doesn't work, maybe hidden by moviepy?
     print(
@@ -29,3 +32,45 @@ def find_prev_unskipped_station(station_idx, settings):
         file=sys.stderr
     )
     return 1
+
+
+def line_continues(settings, station_idx, loop=False, max_stations=8):
+    '''Whether the line goes on past the stations shown, which is marked by
+    triangles at the end of the bar
+    '''
+    return loop or len(settings) - station_idx > max_stations - 1
+
+
+def station_window(settings, station_idx, max_stations=8, loop=False):
+    '''
+    The stations shown in the line graphic, and the position of the arrow
+    relative to the first rectangle, in multiples of the station spacing
+    '''
+    remaining_stations = len(settings) - station_idx
+
+    if loop:
+        # Loop lines never end: show the previous station that isn't skipped
+        # and wrap around past the last station to the first
+        i = find_prev_unskipped_station(station_idx, settings, loop)
+        return [
+            settings[(station_idx - i + idx) % len(settings)]
+            for idx in range(min(max_stations, len(settings)))
+        ], i - 1
+
+    if remaining_stations <= max_stations - 2:
+        # End of the line: show all 8 stations from the last
+        # Move arrow to between next rectangle
+        return settings[-max_stations:], max_stations - 1 - remaining_stations
+
+    if station_idx == 0:
+        # 1st -> 2nd station: show 1st station as 'previous'
+        # Move arrow to center of first rectangle
+        return settings[station_idx:station_idx + max_stations], -1/2
+
+    # Anywhere else in the line: show the previous station that isn't skipped
+    i = find_prev_unskipped_station(station_idx, settings)
+    # Move arrow to between previous and next station rectangle
+    # TODO: add config to disable this
+    # The arrow can also move there from the previous station, see
+    # graphics.arrow_layer()
+    return settings[station_idx - i : station_idx + max_stations - 1], i - 1